@@ -0,0 +1,216 @@
+'''animation of a trial and its export as a video clip
+
+Every artist of the animation is created once and moved in place at each
+frame. Videos are rendered off screen with the Agg backend: the static
+parts of the figure are drawn once, each frame only redraws the moving
+artists over them and its pixels are piped raw into ffmpeg.
+'''
+import os
+import shutil
+import subprocess
+import tempfile
+from multiprocessing import Pool
+import numpy as np
+from matplotlib import animation
+from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+FIGSIZE = (4, 7)
+DPI = 100
+FFMPEG = 'ffmpeg'
+# encoding of the clips, the parts of a parallel export must match for concatenation
+CODEC_ARGS = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+
+class TrialAnimation:
+    '''
+        Animation of a trial. Red dot represents the leader, blue dot
+        represents the follower, the arrow is the velocity of the follower.
+        attributes:
+            fig (matplotlib Figure): The figure drawn on.
+            ax (matplotlib Axes): The axes of the artists.
+            artists (tuple): leader, follower, speed text, velocity arrow
+                    and time text, updated in place by update().
+    '''
+    def __init__(self, trial, velocities=True, fig=None, **kwargs):
+        '''
+        args:
+            trial: An instance of the Trial class.
+            velocities (boolean): Whether draw velocity vectors.
+            fig (matplotlib Figure): Figure to draw on, a new pyplot
+                figure if None.
+            kwargs: rotated, filtered and the arguments of get_kinematics.
+        '''
+        rotated = True if 'rotated' not in kwargs else kwargs['rotated']
+        filtered = True if 'filtered' not in kwargs else kwargs['filtered']
+
+        # get data
+        fkin = trial.get_kinematics('f', **kwargs)
+        lkin = trial.get_kinematics('l', **kwargs)
+        self.lpos = lkin.pos.copy()
+        self.lpos[:trial.f1] = [99,99,0] # make leader out of the ploting range before its onset
+        self.fpos = fkin.pos
+        self.lspd = lkin.spd
+        self.fspd = fkin.spd
+        self.fvel = fkin.vel
+        self.t = trial.get_time(filtered)
+        self.length = len(self.fpos)
+
+        # set up the figure, the axis, and the plot element we want to animate
+        self.fig = plt.figure(figsize=FIGSIZE) if fig is None else fig
+        if rotated:
+            self.ax = self.fig.add_subplot(1, 1, 1, xlim=(-3.5, 3.5), ylim=(-1, 15))
+        else:
+            self.ax = self.fig.add_subplot(1, 1, 1, xlim=(-4.5, 4.5), ylim=(-5.5, 5.5))
+        ax = self.ax
+        ax.set_xlabel('position x')
+        ax.set_ylabel('position y')
+        # Set the aspect ratio of x and y axis equal to the true value
+        ax.set_aspect('equal')
+        filt = ', filtered data' if filtered else ', raw data'
+        ax.set_title('subject ' + str(trial.subject_id) + ' trial ' + str(trial.trial_id) + '\n v0 = ' + str(trial.v0) + filt)
+        # ms is the short for markersize
+        self.leader, = ax.plot([], [], 'ro', ms=10)
+        self.follower, = ax.plot([], [], 'bo', ms=10)
+        self.spd = ax.text(0, 0, '')
+        self.time = ax.text(-2.5, -0.5, '')
+        # a quiver of one arrow in data units, head of 0.1 m like ax.arrow(head_width=0.1)
+        self.arrow = ax.quiver([0], [0], [0], [0], angles='xy', scale_units='xy', scale=1, units='xy',
+                               width=0.02, headwidth=5, headlength=5, headaxislength=5, color='k')
+        self.arrow.set_visible(velocities)
+        self.artists = (self.leader, self.follower, self.spd, self.arrow, self.time)
+        self.update(0)
+
+    def update(self, i):
+        '''
+        Move the artists to frame i and return them.
+        '''
+        self.leader.set_data([self.lpos[i,0]], [self.lpos[i,1]])
+        self.follower.set_data([self.fpos[i,0]], [self.fpos[i,1]])
+        sign = '+' if self.fspd[i] >= self.lspd[i] else '-'
+        s = str(round(self.fspd[i],2)) + '(' + sign + str(round(self.fspd[i]-self.lspd[i],2)) + ')m/s'
+        self.spd.set_text(s)
+        self.spd.set_position((self.fpos[i,0] - 1, self.fpos[i,1] - 0.7))
+        self.time.set_text(str(round(self.t[i], 2)))
+        self.arrow.set_offsets([[self.fpos[i,0], self.fpos[i,1]]])
+        self.arrow.set_UVC([self.fvel[i,0]], [self.fvel[i,1]])
+        return self.artists
+
+    def animate(self, frames=None, interval=11):
+        '''
+        return a FuncAnimation playing <frames> (all frames if None) with
+        <interval> milliseconds between frames.
+        '''
+        frames = range(self.length) if frames is None else frames
+        # blit=True means only re-draw the parts that have changed.
+        return animation.FuncAnimation(self.fig, self.update, frames=frames, interval=interval, blit=True)
+
+    def render(self, out, frames=None):
+        '''
+        Write the raw RGBA pixels of <frames> (all frames if None) to the
+        file object <out>, one frame after the other. The figure must have
+        an Agg canvas. Static parts are drawn once, every frame restores
+        them and draws the artists on top.
+
+        return:
+            Size (width, height) of a frame in pixels.
+        '''
+        frames = range(self.length) if frames is None else frames
+        canvas = self.fig.canvas
+        for a in self.artists:
+            a.set_animated(True)
+        canvas.draw()
+        background = canvas.copy_from_bbox(self.fig.bbox)
+        # in the order of a full draw
+        visible = sorted([a for a in self.artists if a.get_visible()], key=lambda a: a.get_zorder())
+        for i in frames:
+            canvas.restore_region(background)
+            self.update(i)
+            for a in visible:
+                self.ax.draw_artist(a)
+            out.write(canvas.buffer_rgba())
+        return canvas.get_width_height()
+
+def agg_figure(dpi=DPI):
+    '''
+    return a Figure of the animation size with an off screen Agg canvas,
+    usable without display and in worker processes.
+    '''
+    fig = Figure(figsize=FIGSIZE, dpi=dpi)
+    FigureCanvasAgg(fig)
+    return fig
+
+def write_video(trial, filename, frames=None, fps=90, dpi=DPI, velocities=True, ffmpeg=FFMPEG, **kwargs):
+    '''
+    Render <frames> of a trial (all frames if None) into the video file
+    <filename> in this process, through a raw frame pipe into ffmpeg.
+    '''
+    fig = agg_figure(dpi)
+    anim = TrialAnimation(trial, velocities, fig=fig, **kwargs)
+    width, height = fig.canvas.get_width_height()
+    # x264 needs even sizes
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+               '-s', str(width) + 'x' + str(height), '-r', str(fps), '-i', '-',
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2'] + CODEC_ARGS + [filename]
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        anim.render(proc.stdin, frames)
+    finally:
+        proc.stdin.close()
+        code = proc.wait()
+    if code != 0:
+        raise Exception('ffmpeg failed to write ' + filename)
+
+def _write_part(args):
+    trial, filename, frames, kwargs = args
+    write_video(trial, filename, frames, **kwargs)
+    return filename
+
+def save_video(trial, filename=None, frames=None, fps=90, processes=1, ffmpeg=FFMPEG, **kwargs):
+    '''
+    Export a trial as a video clip.
+
+    args:
+        trial: An instance of the Trial class.
+        filename (str): Path of the video, 'Subj<id>Trial<id>.mp4' if None.
+        frames (array of int): Indices of the frames, all frames if None.
+        fps (float): Frames per second of the video.
+        processes (int): Number of worker processes. With more than one,
+                  consecutive ranges of frames are rendered to separate
+                  parts in parallel and concatenated without re-encoding.
+                  None uses every core.
+        ffmpeg (str): The ffmpeg executable.
+        kwargs: dpi, velocities and the arguments of TrialAnimation.
+    return:
+        The path of the video.
+    '''
+    if shutil.which(ffmpeg) is None:
+        raise Exception('Cannot find ' + ffmpeg + ' to write videos')
+    if filename is None:
+        filename = 'Subj' + str(trial.subject_id) + 'Trial' + str(trial.trial_id) + '.mp4'
+    frames = np.arange(trial.length) if frames is None else np.asarray(frames)
+    processes = os.cpu_count() if processes is None else processes
+    parts = [p for p in np.array_split(frames, max(1, min(processes, len(frames)))) if len(p)]
+    if len(parts) <= 1:
+        write_video(trial, filename, frames, fps=fps, ffmpeg=ffmpeg, **kwargs)
+        return filename
+
+    # render the parts next to the video, then join their streams
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        ext = os.path.splitext(filename)[1]
+        names = [os.path.join(tmp, 'part' + str(k).zfill(3) + ext) for k in range(len(parts))]
+        jobs = [(trial, name, part, dict(kwargs, fps=fps, ffmpeg=ffmpeg)) for name, part in zip(names, parts)]
+        with Pool(len(parts)) as pool:
+            pool.map(_write_part, jobs)
+        listing = os.path.join(tmp, 'parts.txt')
+        with open(listing, 'w') as f:
+            for name in names:
+                f.write("file '" + name + "'\n")
+        code = subprocess.call([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                                '-i', listing, '-c', 'copy', filename])
+        if code != 0:
+            raise Exception('ffmpeg failed to concatenate the parts of ' + filename)
+    finally:
+        shutil.rmtree(tmp)
+    return filename
@@ -0,0 +1,192 @@
+'''overtaking classification of many trials at once'''
+import numpy as np
+import helper
+import sliding
+from Tomato3_dataStructure import Experiment, filter_batch, group_trials
+from Tomato3_columnar import trial_table, select_rows
+
+# intermediates shared by the classifiers, added to the trial table
+STATISTICS = ['lat_pos_f1', 'lat_max', 'fwd_vel_max', 'spd_f1', 'cos_angle']
+
+def select_trials(exp, freewalk=False, **criteria):
+    '''
+    return the trials of an Experiment matching all criteria, in the order
+    of Experiment.get_trials, e.g. select_trials(exp, v0=[1.2, 1.3]).
+    A criterion is a column of the trial table and a value or a list of values.
+    '''
+    trials = exp.get_trials(freewalk)
+    if not criteria:
+        return trials
+    return [trials[i] for i in select_rows(trial_table(trials), **criteria)]
+
+def filter_groups(trials, **kwargs):
+    '''
+    Filter the rotated follower positions of many trials, one batch per
+    group of trials sharing the filter parameters and Hz.
+    
+    Args:
+        trials (list): Instances of the Trial class.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
+    Return:
+        A generator of (index, data, lengths), index is the list of
+        positions in <trials> of a group, data and lengths are the result
+        of Tomato3_dataStructure.filter_batch for that group.
+    '''
+    for (order, cutoff, _, backend, Hz), index in group_trials(trials, dict(kwargs, rotated=True)).items():
+        data, lengths = filter_batch([trials[i] for i in index], order, cutoff, True, backend)
+        yield index, data, lengths
+
+def _leader_end(trial):
+    '''
+    return the x-y position of the leader at the last frame, as in
+    trial.get_kinematics('l') but without building the whole series.
+    '''
+    pos = trial.rotate_data(trial.lpos[trial.f1:trial.f1 + 1])[0]
+    return pos[0:2] + [0, (trial.length - trial.f1) * trial.v0 / trial.Hz]
+
+def overtake_statistics(trials, window=1, **kwargs):
+    '''
+    Compute the intermediates of valid_trial, lateral_overtake and
+    angle_overtake (Tomato3_helper) for many trials, filtering the
+    follower positions of all trials in one batch.
+    
+    Args:
+        trials: An instance of the Experiment class, whose experimental
+            trials are used, or a list of instances of the Trial class.
+        window (int): Window in frames of the forward speed average.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
+    Return:
+        The trial table (see Tomato3_columnar.trial_table) with the columns
+            lat_pos_f1: lateral position of the follower when leader appears.
+            lat_max: maximum absolute lateral position from then on.
+            fwd_vel_max: maximum forward velocity averaged over <window>.
+            spd_f1: speed of the follower when leader appears.
+            cos_angle: cosine of the angle between the y axis and the line
+                from follower to leader at the last frame, nan without leader.
+    '''
+    if isinstance(trials, Experiment):
+        trials = trials.get_trials()
+    table = trial_table(trials)
+    stats = {name: np.full(len(trials), np.nan) for name in STATISTICS}
+    for index, data, lengths in filter_groups(trials, **kwargs):
+        group = [trials[i] for i in index]
+        Hz = group[0].Hz
+        rows = np.arange(len(group))
+        f1 = np.array([t.f1 for t in group])
+        frames = np.arange(data.shape[1])
+        lat_pos = data[:, :, 0]
+        stats['lat_pos_f1'][index] = lat_pos[rows, f1]
+        after = (frames >= f1[:, None]) & (frames < lengths[:, None])
+        stats['lat_max'][index] = np.where(after, abs(lat_pos), -np.inf).max(axis=1)
+        vel = helper.gradient_batch(data[:, :, 0:2], lengths, Hz)
+        stats['fwd_vel_max'][index] = sliding.max_average(vel[:, :, 1], window, lengths=lengths)
+        stats['spd_f1'][index] = np.hypot(vel[rows, f1, 0], vel[rows, f1, 1])
+        # line from follower to leader at the last frame
+        ends = np.array([_leader_end(t) if t.leader is not None else [np.nan, np.nan] for t in group])
+        vec = ends - data[rows, lengths - 1, 0:2]
+        stats['cos_angle'][index] = vec[:, 1] / np.hypot(vec[:, 0], vec[:, 1])
+    for name in STATISTICS:
+        table[name] = stats[name]
+    return table
+
+def _last_change(mask, before):
+    '''
+    return for each row of a 2-d boolean array the last frame i < before - 1
+    with mask[i] != mask[i + 1], 0 if there is none. The batch version of
+    taking the last index of helper.find_intersections.
+    '''
+    frames = np.arange(mask.shape[1] - 1)
+    change = (mask[:, 1:] != mask[:, :-1]) & (frames < before[:, None] - 1)
+    return np.maximum(np.where(change, frames, -1).max(axis=1), 0)
+
+def overtake_onsets(lat_pos, lat_vel, f1, lengths, Hz, tolerance=0.02):
+    '''
+    Batch version of Tomato3_helper.overtake_onset, giving the same onsets.
+    
+    Args:
+        lat_pos, lat_vel (2-d np array of float): Lateral position and
+            velocity of the follower with size (trials, frames), padded
+            after the end of each trial.
+        f1 (1-d np array of int): Index when the leader appears in each trial.
+        lengths (1-d np array of int): Number of frames of each trial.
+        Hz (float): Sampling rate.
+        tolerance (float): See Tomato3_helper.overtake_onset.
+    Return:
+        1-d np array of int, the onset frame of each trial.
+    '''
+    lengths = np.asarray(lengths)
+    frames = np.arange(lat_pos.shape[1])
+    inside = frames < lengths[:, None]
+    average = np.cumsum(lat_vel, axis=1) / np.arange(1, lat_vel.shape[1] + 1)
+    pos_peak = np.minimum(np.where(inside, abs(lat_pos), -np.inf).argmax(axis=1), lengths - Hz)
+    pos_peak[pos_peak == 0] = 1
+    # a negative peak counts from the end, as when slicing
+    pos_peak = np.where(pos_peak < 0, lengths + pos_peak, pos_peak)
+    ipeak = np.where(frames < pos_peak[:, None], abs(lat_vel), -np.inf).argmax(axis=1)
+    z = _last_change(abs(lat_vel) < tolerance, ipeak)
+    a = _last_change(abs(lat_vel - average) < tolerance, ipeak)
+    return np.maximum(np.asarray(f1), np.maximum(a, z)).astype(int)
+
+def trial_onsets(trials, tolerance=0.02, **kwargs):
+    '''
+    return a 1-d np array of int, the overtake onset of many trials (see
+    overtake_onsets) from one filter run per group of filter parameters.
+    
+    Args:
+        trials: An instance of the Experiment class, whose experimental
+            trials are used, or a list of instances of the Trial class.
+        tolerance (float): See Tomato3_helper.overtake_onset.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
+    '''
+    if isinstance(trials, Experiment):
+        trials = trials.get_trials()
+    onsets = np.zeros(len(trials), dtype=int)
+    for index, data, lengths in filter_groups(trials, **kwargs):
+        Hz = trials[index[0]].Hz
+        f1 = np.array([trials[i].f1 for i in index])
+        lat_vel = helper.gradient_batch(data[:, :, 0], lengths, Hz)
+        onsets[index] = overtake_onsets(data[:, :, 0], lat_vel, f1, lengths, Hz, tolerance)
+    return onsets
+
+def valid_trials(stats, threshold=0.2):
+    '''
+    return a boolean array, whether each trial of overtake_statistics is
+    valid, see Tomato3_helper.valid_trial.
+    '''
+    return abs(stats['lat_pos_f1'].values) < threshold
+
+def lateral_overtakes(stats, threshold=0.3, valid_threshold=0.2):
+    '''
+    return a boolean array, whether the follower overtakes the leader in
+    each trial of overtake_statistics, see Tomato3_helper.lateral_overtake.
+    Only trials valid with <valid_threshold> (see valid_trials) overtake.
+    '''
+    fwd_vel_max = np.maximum(stats['fwd_vel_max'].values, 0)
+    return valid_trials(stats, valid_threshold) & (fwd_vel_max > stats['v0'].values) & (stats['lat_max'].values > threshold)
+
+def angle_overtakes(stats, threshold=55):
+    '''
+    return a boolean array, whether the follower overtakes the leader in
+    each trial of overtake_statistics, see Tomato3_helper.angle_overtake.
+    '''
+    return stats['cos_angle'].values < np.cos(threshold * np.pi / 180)
+
+def classify_trials(trials, lateral_threshold=0.3, angle_threshold=55, valid_threshold=0.2, window=1, **kwargs):
+    '''
+    Classify many trials in one vectorized pass.
+    
+    Args:
+        trials: An Experiment or a list of trials, see overtake_statistics.
+        lateral_threshold, angle_threshold, valid_threshold: Thresholds of
+            lateral_overtake, angle_overtake and valid_trial.
+        window (int): Window in frames of the forward speed average.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
+    Return:
+        The table of overtake_statistics with the boolean columns 'valid',
+        'lateral' and 'angle'.
+    '''
+    table = overtake_statistics(trials, window, **kwargs)
+    table['valid'] = valid_trials(table, valid_threshold)
+    table['lateral'] = lateral_overtakes(table, lateral_threshold, valid_threshold)
+    table['angle'] = angle_overtakes(table, angle_threshold)
+    return table
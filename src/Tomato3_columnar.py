@@ -0,0 +1,158 @@
+'''columnar storage of an entire experiment'''
+import numpy as np
+import pandas as pd
+from Tomato3_dataStructure import Trial, Subject, Experiment
+
+# per frame arrays of a trial
+CHANNELS = ['lpos', 'fpos', 'fori', 'tstamps', 'leader_model']
+
+# per trial metadata copied from and to Trial attributes
+TRIAL_COLUMNS = ['subject_id', 'trial_id', 'd0', 'v0', 'leader', 'leader_onset', 'f1', 'length', 'Hz',
+                 'order', 'cutoff', 'backend']
+
+def trial_table(trials):
+    '''
+    return a pandas DataFrame with one row of metadata per trial, in the
+    order of <trials>. Freewalk trials are the ones without leader.
+
+    Args:
+        trials (list): Instances of the Trial class.
+    '''
+    table = pd.DataFrame([[getattr(t, c) for c in TRIAL_COLUMNS] for t in trials], columns=TRIAL_COLUMNS)
+    table['freewalk'] = table['leader'].isnull()
+    return table
+
+def select_rows(table, **criteria):
+    '''
+    return the row indices of a trial table matching all criteria, see
+    ColumnarExperiment.select.
+    '''
+    mask = np.ones(len(table), dtype=bool)
+    for column, value in criteria.items():
+        values = value if isinstance(value, (list, tuple, set, np.ndarray)) else [value]
+        mask &= table[column].isin(values).values
+    return np.flatnonzero(mask)
+
+def subject_table(exp):
+    '''
+    return a pandas DataFrame with the id, gender, IPD and leader of
+    every subject of an Experiment.
+    '''
+    return pd.DataFrame([[s.id, s.gender, s.IPD, s.leader] for s in exp.subjects.values()],
+                        columns=['id', 'gender', 'IPD', 'leader'])
+
+class ColumnarExperiment:
+    '''
+        An experiment stored as one contiguous array per channel holding
+        the frames of all trials back to back. Row i of the trial table
+        owns frames offsets[i]:offsets[i + 1] of every channel.
+        attributes:
+            trials (pandas DataFrame): Per trial metadata, see TRIAL_COLUMNS,
+                   plus 'freewalk'.
+            subjects (pandas DataFrame): id, gender, IPD, leader.
+            channels (dict): Channel name to array with size (frames, ...).
+            offsets (1-d np array of int): Start frame of each trial and the
+                    total number of frames.
+    '''
+    def __init__(self, trials, subjects, channels, offsets):
+        self.trials = trials
+        self.subjects = subjects
+        self.channels = channels
+        self.offsets = offsets
+
+    @classmethod
+    def from_experiment(cls, exp):
+        '''
+        Build the columnar representation of an Experiment. Experimental
+        trials come first in each subject, followed by its freewalk trials.
+        '''
+        trials = exp.get_trials(freewalk=True)
+        table = trial_table(trials)
+        offsets = np.concatenate(([0], np.cumsum(table['length']))).astype(int)
+        # freewalk trials have no leader model
+        table['has_leader_model'] = [t.leader_model is not None for t in trials]
+        channels = {}
+        for name in CHANNELS:
+            if name == 'leader_model':
+                series = [np.full(t.length, -1) if t.leader_model is None else t.leader_model for t in trials]
+            else:
+                series = [getattr(t, name) for t in trials]
+            channels[name] = np.concatenate(series)
+        return cls(table, subject_table(exp), channels, offsets)
+
+    def __len__(self):
+        return len(self.trials)
+
+    def channel(self, name, i):
+        '''
+        return the frames of channel <name> that belong to row i of the
+        trial table, as a view.
+        '''
+        return self.channels[name][self.offsets[i]:self.offsets[i + 1]]
+
+    def select(self, **criteria):
+        '''
+        return the row indices of the trials matching all criteria, e.g.
+        select(subject_id=[1, 2], v0=1.2, freewalk=False). A criterion is
+        a column of the trial table and a value or a list of values.
+        '''
+        return select_rows(self.trials, **criteria)
+
+    def trial(self, i):
+        '''
+        return row i of the trial table as a Trial whose arrays are views
+        into the channels.
+        '''
+        return make_trial(self.trials.iloc[i], {name: self.channel(name, i) for name in CHANNELS})
+
+    def to_experiment(self):
+        '''
+        Rebuild the object model. Trial arrays are views into the channels.
+        '''
+        exp = make_experiment(self.subjects)
+        for i in range(len(self)):
+            add_trial(exp, self.trial(i), self.trials['freewalk'].iloc[i])
+        return exp
+
+def trial_metadata(row):
+    '''
+    return a row of a trial table as a dictionary of python scalars, with
+    None for the leader of freewalk trials and missing leader onsets.
+    '''
+    row = {k: v.item() if hasattr(v, 'item') else v for k, v in row.items()}
+    row['leader'] = None if row['freewalk'] else row['leader']
+    row['leader_onset'] = None if pd.isnull(row['leader_onset']) else row['leader_onset']
+    return row
+
+def make_trial(row, arrays):
+    '''
+    return a Trial from a row of a trial table and its per frame arrays.
+
+    Args:
+        row (pandas Series): Metadata, see TRIAL_COLUMNS.
+        arrays (dict): Channel name to array, see CHANNELS.
+    '''
+    row = trial_metadata(row)
+    leader_model = arrays['leader_model'] if row['has_leader_model'] else None
+    return Trial(row['subject_id'], row['trial_id'], arrays['lpos'], arrays['fpos'], arrays['fori'],
+                 arrays['tstamps'], row['v0'], row['leader'], row['leader_onset'], leader_model, d0=row['d0'],
+                 Hz=row['Hz'], order=row['order'], cutoff=row['cutoff'], backend=row['backend'], f1=row['f1'])
+
+def make_experiment(subjects):
+    '''
+    return an Experiment with the subjects of a subject table and no trials.
+    '''
+    exp = Experiment()
+    for _, row in subjects.iterrows():
+        gender = None if pd.isnull(row['gender']) else row['gender']
+        IPD = None if pd.isnull(row['IPD']) else row['IPD']
+        leader = None if pd.isnull(row['leader']) else row['leader']
+        exp.subjects[int(row['id'])] = Subject(int(row['id']), gender, IPD, leader)
+    return exp
+
+def add_trial(exp, trial, freewalk):
+    subject = exp.subjects[trial.subject_id]
+    if freewalk:
+        subject.freewalk[trial.trial_id] = trial
+    else:
+        subject.trials[trial.trial_id] = trial
@@ -1,15 +1,60 @@
 '''data structure'''
+from collections import OrderedDict
 import numpy as np
 import matplotlib as mpl
-from matplotlib import animation
 from matplotlib import pyplot as plt
 from matplotlib import cm
-from scipy.signal import butter, filtfilt
-from scipy.interpolate import interp1d
+from matplotlib.collections import LineCollection
+import helper
+import filters
+import resample
+from Tomato3_animation import TrialAnimation, save_video
+
+class Kinematics:
+    '''
+        Position, velocity, acceleration and planar speed of one agent
+        in a trial, computed in a single pass. All arrays are read-only
+        views into one preallocated buffer.
+        attributes:
+            pos, vel, acc (2-d np array): column0:x column1:y column2:z
+            spd (1-d np array): speed in the x-y plane
+            lat_*, fwd_* (1-d np array): lateral (x) and forward (y)
+                         component of pos, vel and acc
+    '''
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.pos = buffer[:, 0:3]
+        self.vel = buffer[:, 3:6]
+        self.acc = buffer[:, 6:9]
+        self.spd = buffer[:, 9]
+        
+    @property
+    def lat_pos(self):
+        return self.pos[:, 0]
+    
+    @property
+    def fwd_pos(self):
+        return self.pos[:, 1]
+    
+    @property
+    def lat_vel(self):
+        return self.vel[:, 0]
+    
+    @property
+    def fwd_vel(self):
+        return self.vel[:, 1]
+    
+    @property
+    def lat_acc(self):
+        return self.acc[:, 0]
+    
+    @property
+    def fwd_acc(self):
+        return self.acc[:, 1]
 
 class Trial:
     def __init__(self, subject_id, trial_id, lpos, fpos, fori, tstamps, v0, leader, leader_onset, leader_model, \
-                 d0=2, Hz=90, order = 4, cutoff = 0.6):
+                 d0=2, Hz=90, order = 4, cutoff = 0.6, backend='filtfilt', cache_size=16, f1=None):
         self.subject_id = subject_id
         self.trial_id = trial_id
         self.d0 = d0
@@ -20,20 +65,80 @@ class Trial:
         self.fpos = fpos # unfilered time series of follower position, 2-d np array, column0:x column1:y  
         self.fori = fori # unfilered time series of follower orientation , 2-d np array, column0-2:yaw pitch row  
         self.Hz = Hz
-        self.tstamps_smooth = np.linspace(0, self.tstamps[-1], num=len(self.tstamps))
+        self.timebase = resample.timebase(self.length, Hz) # time axis of filtered data
+        self.tstamps_smooth = self.timebase
         self.theta = np.arctan(9/11); # The smaller angle of the diagonal of the walking space
         self.leader = leader
         self.leader_onset = leader_onset
         self.leader_model = leader_model
         self.order = order
         self.cutoff = cutoff
+        self.backend = backend # zero-phase filter implementation, see filters.BACKENDS
+        # derived data (positions, velocities...) memoized by their parameters
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
         # find f1, the index when the leader appears
-        if leader != None:
+        if f1 is not None:
+            # already known, e.g. from a stored trial table
+            self.f1 = f1
+        elif leader != None:
             # find the index of the first non zero value
             self.f1 = (self.lpos - self.lpos[0] != [0,0,0]).argmax()//3
         else:
             self.f1 = 1
     
+    def __getstate__(self):
+        # derived data is cheap to rebuild, do not pickle it
+        state = self.__dict__.copy()
+        state['_cache'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        # trials pickled before the cache existed lack these attributes
+        if 'timebase' not in state:
+            state['timebase'] = state['tstamps_smooth'] = resample.timebase(state['length'], state['Hz'])
+        state.setdefault('backend', 'filtfilt')
+        state.setdefault('cache_size', 16)
+        state.setdefault('_cache', OrderedDict())
+        self.__dict__.update(state)
+
+    def _cached(self, key, compute):
+        '''
+            Return the derived data stored under key, computing it with
+            compute() on a miss. Arrays are returned read-only since they
+            are shared by every caller. The least recently used entry is
+            evicted when the cache holds more than cache_size entries.
+        '''
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        return self._store(key, compute())
+    
+    def _store(self, key, data):
+        if isinstance(data, np.ndarray):
+            data = data.view()
+            data.flags.writeable = False
+        self._cache[key] = data
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return data
+
+    def invalidate(self):
+        '''
+            Drop all memoized derived data. Call this after modifying the
+            raw arrays (lpos, fpos, tstamps...) in place.
+        '''
+        self._cache.clear()
+
+    def _parameters(self, kwargs):
+        order = self.order if 'order' not in kwargs else kwargs['order']
+        cutoff = self.cutoff if 'cutoff' not in kwargs else kwargs['cutoff']
+        rotated = True if 'rotated' not in kwargs else kwargs['rotated']
+        filtered = True if 'filtered' not in kwargs else kwargs['filtered']
+        backend = self.backend if 'backend' not in kwargs else kwargs['backend']
+        return order, cutoff, rotated, filtered, backend
+
     def rotate_data(self, data):
         '''
             Rotate the data so that the new y axis points from homepole 
@@ -50,33 +155,57 @@ class Trial:
         xy = np.matmul(trans_data[:,0:2], R)
         return np.stack((xy[:,0], xy[:,1], trans_data[:,2]), axis=1)
    
-    def filter_data(self, data, order, cutoff):
+    def filter_data(self, data, order, cutoff, backend='filtfilt'):
         '''
             Filter the data using butterwirth low pass digital foward
             and backward filter.
         '''
-        # interpolate and extrapolate (add pads on two sides to prevent boundary effects)
+        # interpolate onto the timebase and extrapolate (add pads on two
+        # sides to prevent boundary effects)
         pad = 3
-        func = interp1d(self.tstamps, data, axis=0, kind='linear', fill_value='extrapolate')
-        indices = [i*1.0/self.Hz for i in list(range(-pad*self.Hz, len(data) + pad*self.Hz))]
-        data = func(indices)
-        # low pass filter on position
-        b, a = butter(order, cutoff/(self.Hz/2.0))
-        data = filtfilt(b, a, data, axis=0, padtype=None) # no auto padding
+        data = resample.resample(self.tstamps, data, self.Hz, pad)
+        # low pass filter on position, no auto padding
+        data = filters.zero_phase(data, order, cutoff, self.Hz, backend)
         # remove pads
         data = data[pad*self.Hz:-pad*self.Hz]
         return data
     
     def get_time(self, filtered):
-        return self.tstamps_smooth if filtered else self.tstamps
+        return self.timebase if filtered else self.tstamps
+    
+    def get_kinematics(self, role, **kwargs):
+        '''
+            Compute positions, velocities, accelerations and speeds of
+            an agent in one pass.
+            args:
+                role (str): 'l' leader, 'f' follower.
+                kwargs: order, cutoff, rotated, filtered, backend.
+            return:
+                A read-only Kinematics instance.
+        '''
+        params = self._parameters(kwargs)
+        key = ('kin', role) + params
+        return self._cached(key, lambda: self._build_kinematics(role, self._compute_positions(role, *params)))
+    
+    def _build_kinematics(self, role, positions):
+        buffer = np.empty((self.length, 10))
+        kin = Kinematics(buffer)
+        kin.pos[:] = positions
+        pos = kin.pos
+        if role == 'l':
+            # leader stands still at its first position before onset
+            pos = pos.copy()
+            pos[:self.f1] = pos[self.f1]
+        helper.gradient(pos, self.Hz, out=kin.vel)
+        helper.gradient(kin.vel, self.Hz, out=kin.acc)
+        np.hypot(kin.vel[:, 0], kin.vel[:, 1], out=kin.spd)
+        buffer.flags.writeable = False
+        return kin
     
     def get_positions(self, role, **kwargs):
-        # load kwargs
-        order = self.order if 'order' not in kwargs else kwargs['order']
-        cutoff = self.cutoff if 'cutoff' not in kwargs else kwargs['cutoff']
-        rotated = True if 'rotated' not in kwargs else kwargs['rotated']
-        filtered = True if 'filtered' not in kwargs else kwargs['filtered']
-        
+        return self.get_kinematics(role, **kwargs).pos
+
+    def _compute_positions(self, role, order, cutoff, rotated, filtered, backend='filtfilt'):
         if role == 'l':
             data = self.lpos
             if filtered or rotated:
@@ -91,24 +220,19 @@ class Trial:
             if rotated:
                 data = self.rotate_data(data)
             if filtered:
-                data = self.filter_data(data, order, cutoff)
+                data = self.filter_data(data, order, cutoff, backend)
         return data
     
     def get_velocities(self, role, **kwargs):
-        pos = self.get_positions(role, **kwargs)
-        if role == 'l':
-            pos[:self.f1] = pos[self.f1]
-        return np.gradient(pos, axis=0)*self.Hz
+        return self.get_kinematics(role, **kwargs).vel
     
     def get_speeds(self, role, **kwargs):
-        vel = self.get_velocities(role, **kwargs)
-        return np.linalg.norm(vel[:,0:2], axis=1)
+        return self.get_kinematics(role, **kwargs).spd
     
     def get_accelerations(self, role, **kwargs):
-        vel = self.get_velocities(role, **kwargs)
-        return np.gradient(vel, axis=0)*self.Hz
+        return self.get_kinematics(role, **kwargs).acc
 
-    def plot_trajectory(self, frames=None, accelerations=False, links=False, **kwargs):
+    def plot_trajectory(self, frames=None, accelerations=False, links=False, show=True, **kwargs):
         '''
             Show the trajectories of follower and leader using scatter plot.
             args:
@@ -117,17 +241,19 @@ class Trial:
                 links (boolean): Whether draw links between the positions of 
                        follower and leader at the same moment for a sense 
                        of concurrency.
+                show (boolean): Whether show the figure.
+            return:
+                The matplotlib Figure.
         ''' 
         # load kwargs
         rotated = True if 'rotated' not in kwargs else kwargs['rotated']
         filtered = True if 'filtered' not in kwargs else kwargs['filtered']
         
         # get data
-        fpos = self.get_positions('f', **kwargs)
-        fspd = self.get_speeds('f', **kwargs)
-        facc = self.get_accelerations('f', **kwargs)
-        lpos = self.get_positions('l', **kwargs)
-        lspd = self.get_speeds('l', **kwargs)
+        fkin = self.get_kinematics('f', **kwargs)
+        lkin = self.get_kinematics('l', **kwargs)
+        fpos, fspd, facc = fkin.pos, fkin.spd, fkin.acc
+        lpos, lspd = lkin.pos, lkin.spd
         f1 = self.f1
         f2 = len(self.tstamps)
         if not frames: frames = list(range(f2))
@@ -145,11 +271,11 @@ class Trial:
         
         # set the aspect ratio equal to that of the actual value
         ax.set_aspect('auto')
-        cmap = cm.get_cmap('plasma')
-#         cmap = cm.get_cmap('rainbow')
+        cmap = plt.get_cmap('plasma')
+#         cmap = plt.get_cmap('rainbow')
         # add labels and color bar
         norm = mpl.colors.Normalize(vmin=0.8, vmax=1.6)
-        cb = plt.colorbar(cm.ScalarMappable(norm=norm, cmap=cmap))
+        cb = plt.colorbar(cm.ScalarMappable(norm=norm, cmap=cmap), ax=ax)
         cb.set_label('m/s')
     
         # plot leader and follower pos  
@@ -158,40 +284,47 @@ class Trial:
         ax.scatter(fpos[frames,0], fpos[frames,1], c=cmap((fspd[frames] - 0.8) / 0.8), \
                     marker=',', s=[0.5] * len(frames))
         
-        # plot acceleration vectors as arrows
+        # plot acceleration vectors as arrows, all in one quiver
         if accelerations and filtered:                 
-            for i in range(frames[0], frames[-1], 9):
-                plt.arrow(fpos[i,0], fpos[i,1], facc[i,0], facc[i,1], head_width=0.03, length_includes_head=True, color='k')
+            i = np.arange(frames[0], frames[-1], 9)
+            ax.quiver(fpos[i,0], fpos[i,1], facc[i,0], facc[i,1], angles='xy', scale_units='xy', scale=1, \
+                      units='dots', width=1, headwidth=4, headlength=5, headaxislength=5, color='k')
         
-        # plot links between follower position and leader position
+        # plot links between follower position and leader position, as one collection
         if links:
-            for i in range(frames[0], frames[-1], int(self.Hz/2)):
-                if i >= f1:
-                    x1, y1 = fpos[i,0], fpos[i,1]
-                    x2, y2 = lpos[i,0], lpos[i,1]
-                    plt.plot([x1,x2], [y1,y2], '--', lw=1, c='0.5')
+            i = np.arange(frames[0], frames[-1], int(self.Hz/2))
+            i = i[i >= f1]
+            segments = np.stack((fpos[i,:2], lpos[i,:2]), axis=1)
+            ax.add_collection(LineCollection(segments, linestyles='--', linewidths=1, colors='0.5'))
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
     
-    def plot_positions(self, component='x', frames=None, **kwargs):
+    def plot_positions(self, component='x', frames=None, show=True, **kwargs):
         '''
             Plot positions of follower and leader by time.
             args:
                 component (str): 'x' lateral position, 'y' forward position,
                                 default is 'x'.
                 frames (array of int): List of indices to be plotted.
+                show (boolean): Whether show the figure.
+            return:
+                The matplotlib Figure.
         '''
         # load kwargs
         filtered = True if 'filtered' not in kwargs else kwargs['filtered']
         
         # get data
+        fkin = self.get_kinematics('f')
+        lkin = self.get_kinematics('l')
         if component == 'x':
-            fpos = self.get_positions('f')[:, 0]
-            lpos = self.get_positions('l')[:, 0]
+            fpos = fkin.lat_pos
+            lpos = lkin.lat_pos
             yrange = (-2, 2)
         elif component == 'y':
-            fpos = self.get_positions('f')[:, 1]
-            lpos = self.get_positions('l')[:, 1]
+            fpos = fkin.fwd_pos
+            lpos = lkin.fwd_pos
             yrange = (-1, 15)
         t = self.get_time(filtered)
         if not frames: frames = list(range(len(t)))
@@ -219,9 +352,11 @@ class Trial:
         # add legend
         ax.legend(lines, labels)        
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
     
-    def plot_speeds(self, component='', frames=None, distance=True, **kwargs):
+    def plot_speeds(self, component='', frames=None, distance=True, show=True, **kwargs):
         '''
             Plot speeds of follower and leader by time
             args:
@@ -230,22 +365,27 @@ class Trial:
                 frames (array of int): List of indices to be plotted.
                 distance (boolean): Whether draw distance indicator
                           (distance/10) on top of leader speed.
+                show (boolean): Whether show the figure.
+            return:
+                The matplotlib Figure.
         '''
         # load kwargs
         filtered = True if 'filtered' not in kwargs else kwargs['filtered']
         
         # get data
-        fspd = self.get_speeds('f', **kwargs)
+        fkin = self.get_kinematics('f', **kwargs)
+        lkin = self.get_kinematics('l', **kwargs)
+        fspd = fkin.spd
         yrange = (-0.5, 2)
         if component == 'x':
-            fspd = self.get_velocities('f', **kwargs)[:, 0]
+            fspd = fkin.lat_vel
             yrange = (-1, 1)
         elif component == 'y':
-            fspd = self.get_velocities('f', **kwargs)[:, 1]
+            fspd = fkin.fwd_vel
             yrange = (-0.5, 2)
-        lspd = self.get_speeds('l', **kwargs)
-        lpos = self.get_positions('l', **kwargs)
-        fpos = self.get_positions('f', **kwargs)
+        lspd = lkin.spd
+        lpos = lkin.pos
+        fpos = fkin.pos
         t = self.get_time(filtered)
         if not frames: frames = list(range(len(t)))
      
@@ -262,10 +402,12 @@ class Trial:
         if component != 'x':
             # plot distance
             if distance:
-                for i in range(self.f1 + 1, len(lpos)):
-                    x1, x2, y1, y2 = t[i], t[i], lspd[i], lspd[i] + (lpos[i,1] - fpos[i,1]) / 10
-                    line3 = ax.plot([x1, x2], [y1, y2], c='0.8')
-                lines.append(line3[0])
+                # one vertical segment per frame, all in one collection
+                i = np.arange(self.f1 + 1, len(lpos))
+                y1, y2 = lspd[i], lspd[i] + (lpos[i,1] - fpos[i,1]) / 10
+                segments = np.stack((np.stack((t[i], y1), axis=1), np.stack((t[i], y2), axis=1)), axis=1)
+                line3 = ax.add_collection(LineCollection(segments, colors='0.8'))
+                lines.append(line3)
                 labels.append('distance/10')
             # plot leader spd
             line1 = ax.plot(t[self.f1 + 1:], lspd[self.f1 + 1:])
@@ -279,9 +421,11 @@ class Trial:
         # add legend
         ax.legend(lines, labels)        
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
     
-    def plot_accelerations(self, component='', frames=None, distance=True, **kwargs):
+    def plot_accelerations(self, component='', frames=None, distance=True, show=True, **kwargs):
         '''
             Plot the acceleration of the follower of follower and leader
             by time.
@@ -293,19 +437,23 @@ class Trial:
                 links (boolean): Whether draw links between the positions of 
                        follower and leader at the same moment for a sense 
                        of concurrency.
+                show (boolean): Whether show the figure.
+            return:
+                The matplotlib Figure.
         '''
         
         # load kwargs
         filtered = True if 'filtered' not in kwargs else kwargs['filtered']
         
         # get data 
-        facc = np.linalg.norm(self.get_accelerations('f')[:, 0:2], axis=1)
+        fkin = self.get_kinematics('f')
+        facc = np.linalg.norm(fkin.acc[:, 0:2], axis=1)
         yrange = (-0.5, 2)
         if component == 'x':
-            facc = self.get_accelerations('f')[:, 0]
+            facc = fkin.lat_acc
             yrange = (-1, 1)
         elif component == 'y':
-            facc = self.get_accelerations('f')[:, 1]
+            facc = fkin.fwd_acc
             yrange = (-0.5, 2)
         t = self.get_time(filtered)
         if not frames: frames = list(range(len(t)))
@@ -321,120 +469,179 @@ class Trial:
         # plot accelerations
         ax.plot(t[frames], facc[frames])
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
         
     def play_trial(self, frames=None, velocities = True, interval=11, save=False, **kwargs):
         '''
         Animate the trial. Red dot represents the leader, blue dot
-        represent the follower.
+        represent the follower. Artists are created once and updated in
+        place, see Tomato3_animation.
         
         args:
             frames (array of int): List of indices to be plotted.
             velocities (boolean): Whether draw velocity vectors.
             interval (int): Delay between frames in milliseconds.
-            save (boolean): Whether save animation as a video clip.
+            save (boolean): Whether save animation as a video clip
+                 'Subj<id>Trial<id>.mp4', this requires ffmpeg.
+            processes (int): Number of worker processes rendering the
+                      video, see Tomato3_animation.save_video.
+        return:
+            The FuncAnimation.
         '''
-        
-        # load kwargs
-        rotated = True if 'rotated' not in kwargs else kwargs['rotated']
-        filtered = True if 'filtered' not in kwargs else kwargs['filtered']
-        
-        # get data
-        lpos = self.get_positions('l', **kwargs)
-        lpos[:self.f1] = [99,99,0] # make leader out of the ploting range before its onset        
-        fpos = self.get_positions('f', **kwargs)
-        lspd = self.get_speeds('l', **kwargs)
-        fspd = self.get_speeds('f', **kwargs)
-        pos_x = np.stack((lpos[:,0], fpos[:,0]), axis=1)
-        pos_y = np.stack((lpos[:,1], fpos[:,1]), axis=1)
-        fvel = self.get_velocities('f', **kwargs)
-        t = self.get_time(filtered)
-        
-        # set up the figure, the axis, and the plot element we want to animate
-        fig = plt.figure(figsize=(4,7))
-        if rotated:
-            ax = plt.axes(xlim=(-3.5, 3.5), ylim=(-1, 15))
-        else:
-            ax = plt.axes(xlim=(-4.5, 4.5), ylim=(-5.5, 5.5))
-        plt.xlabel('position x')
-        plt.ylabel('position y')
-        # Set the aspect ratio of x and y axis equal to the true value
-        ax.set_aspect('equal')
-        filt = ', filtered data' if filtered else ', raw data'
-        plt.title('subject ' + str(self.subject_id) + ' trial ' + str(self.trial_id) + '\n v0 = ' + str(self.v0) + filt)       
-        # initialize animation data
-        leader, = ax.plot(lpos[0,0], lpos[0,1], 'ro', ms=10)
-        follower, = ax.plot(fpos[0,0], fpos[0,1], 'bo', ms=10)
-        clr = 'k' if velocities else 'w'
-        sign = '+' if fspd[0] >= lspd[0] else '-' 
-        s = str(round(fspd[0],2)) + '(' + sign + str(round(fspd[0]-lspd[0],2)) + ')m/s'
-        spd = ax.text(fpos[0,0] + 0.5, fpos[0,1] - 0.5, s)
-        time = ax.text(-2.5, -0.5, str(round(t[0], 2)))
-        # 
-        def animate_slow(i):
-            '''
-            slow animation function redraw everything at each frame. 
-            Good for saving video but too slow to watch in real time.
-            '''
-            # ms is the short for markersize
-            # figure labels and size
-            ax.clear()
-            if rotated:
-                ax.set_xlim(-3.5, 3.5)
-                ax.set_ylim(-1, 15)
-            else:
-                ax.set_xlim(-4.5, 4.5)
-                ax.set_ylim(-5.5, 5.5)
-            ax.set_xlabel('position x')
-            ax.set_ylabel('position y')
-            
-            # Set the aspect ratio of x and y axis equal to the true value
-            ax.set_aspect('equal')
-            # set title
-            filt = ', filtered data' if filtered else ', raw data'
-            ax.set_title('subject ' + str(self.subject_id) + ' trial ' + str(self.trial_id) + '\n v0 = ' + str(self.v0) + filt)       
-            
-            # update data
-            leader, = ax.plot(lpos[i,0], lpos[i,1], 'ro', ms=10)
-            follower, = ax.plot(fpos[i,0], fpos[i,1], 'bo', ms=10)
-            sign = '+' if fspd[i] >= lspd[i] else '-' 
-            s = str(round(fspd[i],2)) + '(' + sign + str(round(fspd[i]-lspd[i],2)) + ')m/s'
-            time.set_text(str(round(t[i], 2)))
-            spd = ax.text(fpos[i,0] - 1, fpos[i,1] - 0.7, s)
-            arr = ax.arrow(fpos[i,0], fpos[i,1], fvel[i,0], fvel[i,1], head_width=0.1, length_includes_head=True, color=clr)
-            return leader, follower, spd, arr, time
-
-        def animate_fast(i):
-            '''
-            Fast animation function update without clear. Good for
-            watching in real time, but will leave trace if saved.
-            '''
-            # ms is the short for markersize
-            leader.set_data(lpos[i,0], lpos[i,1])
-            follower.set_data(fpos[i,0], fpos[i,1])
-            sign = '+' if fspd[i] >= lspd[i] else '-' 
-            s = str(round(fspd[i],2)) + '(' + sign + str(round(fspd[i]-lspd[i],2)) + ')m/s'
-            spd.set_text(s)
-            spd.set_position((fpos[i,0] - 1, fpos[i,1] - 0.7))
-            time.set_text(str(round(t[i], 2)))
-            arr = ax.arrow(fpos[i,0], fpos[i,1], fvel[i,0], fvel[i,1], head_width=0.1, length_includes_head=True, color=clr)
-            return leader, follower, spd, arr, time
-        # call the animator.  blit=True means only re-draw the parts that have changed.
-        animate = animate_slow if save else animate_fast
-        anim = animation.FuncAnimation(fig, animate, frames=len(pos_x), interval=interval, blit=True)
-
-        # save the animation as an mp4.  This requires ffmpeg or mencoder to be
-        # installed.  The extra_args ensure that the x264 codec is used, so that
-        # the video can be embedded in html5.  You may need to adjust this for
-        # your system: for more information, see
-        # http://matplotlib.sourceforge.net/api/animation_api.html
+        processes = kwargs.pop('processes', 1)
+        anim = TrialAnimation(self, velocities, **kwargs).animate(frames, interval)
         if save:
-            filename = 'Subj' + str(self.subject_id) + 'Trial' + str(self.trial_id) + '.mp4'
-            anim.save(filename, fps=None)
+            save_video(self, frames=frames, fps=1000.0 / interval, processes=processes, velocities=velocities, **kwargs)
         return anim
         # For command line usage
         # plt.show()
     
+class MemoryBudget:
+    '''
+        Keeps the arrays loaded by LazyTrial proxies sharing this budget,
+        and the derived data they cache, under a number of bytes. When a
+        proxy loads or caches past the limit, the least recently used
+        other proxies release their arrays.
+        attributes:
+            limit (int): Maximum number of bytes, None for no limit.
+            used (int): Bytes currently loaded.
+    '''
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self._loaded = OrderedDict() # proxy -> bytes, least recently used first
+
+    def __len__(self):
+        return len(self._loaded)
+
+    def touch(self, trial):
+        if trial in self._loaded:
+            self._loaded.move_to_end(trial)
+
+    def add(self, trial, nbytes):
+        # replaces the previous charge of the proxy
+        self.used += nbytes - self._loaded.pop(trial, 0)
+        self._loaded[trial] = nbytes
+        while self.limit is not None and self.used > self.limit and len(self._loaded) > 1:
+            oldest = next(iter(self._loaded))
+            if oldest is trial:
+                break
+            oldest.release()
+
+    def remove(self, trial):
+        if trial in self._loaded:
+            self.used -= self._loaded.pop(trial)
+
+def _lazy_array(name):
+    def get(self):
+        if self._arrays is None:
+            self.load()
+        elif self.budget is not None:
+            self.budget.touch(self)
+        return self._arrays[name]
+    return property(get)
+
+def _nbytes(data):
+    if isinstance(data, Kinematics):
+        return data.buffer.nbytes
+    return data.nbytes if isinstance(data, np.ndarray) else 0
+
+class LazyTrial(Trial):
+    '''
+        A Trial that holds only its metadata until one of its arrays
+        (lpos, fpos, fori, tstamps, leader_model) is first accessed, then
+        loads all of them with loader(). Behaves like a Trial otherwise.
+        args:
+            length (int): Number of frames, known without loading.
+            f1 (int): Index when the leader appears.
+            loader: Callable returning a dictionary from array name to
+                    array, leader_model is None for freewalk trials. Must
+                    be picklable to pickle the trial.
+            budget: An instance of MemoryBudget shared by the proxies whose
+                    loaded arrays it limits, None for no limit.
+    '''
+    lpos = _lazy_array('lpos')
+    fpos = _lazy_array('fpos')
+    fori = _lazy_array('fori')
+    tstamps = _lazy_array('tstamps')
+    leader_model = _lazy_array('leader_model')
+
+    def __init__(self, subject_id, trial_id, v0, leader, leader_onset, length, f1, loader, budget=None, \
+                 d0=2, Hz=90, order=4, cutoff=0.6, backend='filtfilt', cache_size=16):
+        self.subject_id = subject_id
+        self.trial_id = trial_id
+        self.d0 = d0
+        self.v0 = v0
+        self.length = length
+        self.f1 = f1
+        self.Hz = Hz
+        self.timebase = resample.timebase(self.length, Hz)
+        self.tstamps_smooth = self.timebase
+        self.theta = np.arctan(9/11)
+        self.leader = leader
+        self.leader_onset = leader_onset
+        self.order = order
+        self.cutoff = cutoff
+        self.backend = backend
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.loader = loader
+        self.budget = budget
+        self._arrays = None
+
+    def __getstate__(self):
+        # arrays are reloaded and the budget is local to this process
+        state = Trial.__getstate__(self)
+        state['_arrays'] = None
+        state['budget'] = None
+        return state
+
+    @property
+    def loaded(self):
+        return self._arrays is not None
+
+    @property
+    def nbytes(self):
+        '''
+            Bytes of the loaded arrays and of the cached derived data.
+        '''
+        raw = 0 if self._arrays is None else sum(x.nbytes for x in self._arrays.values() if x is not None)
+        return raw + sum(_nbytes(x) for x in self._cache.values())
+
+    def _charge(self):
+        if self.budget is not None:
+            self.budget.add(self, self.nbytes)
+
+    def _store(self, key, data):
+        data = Trial._store(self, key, data)
+        self._charge()
+        return data
+
+    def invalidate(self):
+        Trial.invalidate(self)
+        if self.loaded:
+            self._charge()
+
+    def load(self):
+        '''
+            Load the arrays, releasing other proxies if the budget is exceeded.
+        '''
+        if self._arrays is None:
+            self._arrays = self.loader()
+            self._charge()
+
+    def release(self):
+        '''
+            Drop the arrays and all derived data, they are loaded again
+            on the next access.
+        '''
+        if self.budget is not None:
+            self.budget.remove(self)
+        self._arrays = None
+        self.invalidate()
+
 # create subject class
 class Subject:
     def __init__(self, id, gender=None, IPD=None, leader=None, trials=None, freewalk=None):
@@ -444,10 +651,107 @@ class Subject:
         self.leader = leader
         self.trials = trials if trials is not None else {}
         self.freewalk = freewalk if freewalk is not None else {}
+
+    def plot_density(self, value='occupancy', relative=False, show=True, **kwargs):
+        '''
+            Plot the follower occupancy or mean speed over all trials of
+            the subject, one grid per leader and v0.
+            args:
+                value (str): 'occupancy' or 'speed'.
+                relative (boolean): Whether positions are relative to the leader.
+                show (boolean): Whether show the figure.
+                kwargs: cell, extent, chunk, order, cutoff, backend, see
+                        Tomato3_density.density_grids.
+            return:
+                The matplotlib Figure.
+        '''
+        from Tomato3_density import density_grids
+        grids = density_grids(self, relative, **kwargs)
+        return grids.plot(value, show, 'subject ' + str(self.id))
         
 # create Experiment class
 class Experiment:
     def __init__(self, n=None, subjects=None):
         self.n = n
         self.subjects = subjects if subjects is not None else {}
+    
+    def get_trials(self, freewalk=False):
+        '''
+            return a list of all experimental trials ordered by subject
+            and trial id, followed by freewalk trials if freewalk is True.
+        '''
+        trials = []
+        for i in sorted(self.subjects):
+            s = self.subjects[i]
+            trials += [s.trials[j] for j in sorted(s.trials)]
+            if freewalk:
+                trials += [s.freewalk[j] for j in sorted(s.freewalk)]
+        return trials
+    
+    def filter_all(self, freewalk=True, **kwargs):
+        '''
+            Filter the follower positions of every trial in one batch and
+            store the results in the trials' caches, so later calls of
+            get_kinematics('f', **kwargs) do not filter again.
+            args:
+                freewalk (boolean): Whether include freewalk trials.
+                kwargs: order, cutoff, rotated, backend as in Trial.get_positions.
+        '''
+        trials = self.get_trials(freewalk)
+        for (order, cutoff, rotated, backend, Hz), index in group_trials(trials, kwargs).items():
+            group = [trials[i] for i in index]
+            data, lengths = filter_batch(group, order, cutoff, rotated, backend)
+            for t, d, n in zip(group, data, lengths):
+                key = ('kin', 'f', order, cutoff, rotated, True, backend)
+                t._store(key, t._build_kinematics('f', d[:n]))
 
+    def plot_density(self, value='occupancy', relative=False, show=True, **kwargs):
+        '''
+            Plot the follower occupancy or mean speed over all experimental
+            trials, one grid per leader and v0, see Subject.plot_density.
+        '''
+        from Tomato3_density import density_grids
+        grids = density_grids(self, relative, **kwargs)
+        return grids.plot(value, show, 'all subjects')
+
+def group_trials(trials, kwargs):
+    '''
+    Group trials by the parameters of their filter run.
+
+    Args:
+        trials (list): Instances of the Trial class.
+        kwargs (dict): order, cutoff, rotated, backend as in Trial.get_positions.
+    Return:
+        A dictionary from (order, cutoff, rotated, backend, Hz) to the list
+        of positions in <trials> of the trials filtered with them.
+    '''
+    # trials can only share a filter run if they share its parameters
+    groups = {}
+    for i, t in enumerate(trials):
+        order, cutoff, rotated, _, backend = t._parameters(kwargs)
+        groups.setdefault((order, cutoff, rotated, backend, t.Hz), []).append(i)
+    return groups
+
+def filter_batch(trials, order, cutoff, rotated=True, backend='filtfilt'):
+    '''
+    Filter the follower positions of many trials with a single vectorized
+    forward-backward pass, equivalent to Trial.filter_data applied to
+    each trial.
+    
+    Args:
+        trials (list): Instances of the Trial class sharing Hz.
+        order, cutoff: Parameters of the Butterworth filter.
+        rotated (boolean): Whether filter the rotated positions.
+        backend (str): Filter implementation, see filters.BACKENDS.
+    Return:
+        data (3-d np array): Filtered positions with size (trials, frames, 3),
+        padded after the end of each trial.
+        lengths (1-d np array of int): Number of frames of each trial.
+    '''
+    Hz = trials[0].Hz
+    pad = 3
+    series = [t.rotate_data(t.fpos) if rotated else t.fpos for t in trials]
+    data, lengths = resample.resample_batch([t.tstamps for t in trials], series, Hz, pad)
+    data = filters.zero_phase_batch(data, lengths, order, cutoff, Hz, backend)
+    # remove pads
+    return data[:, pad*Hz:-pad*Hz], lengths - 2*pad*Hz
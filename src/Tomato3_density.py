@@ -0,0 +1,195 @@
+'''follower trajectory density of many trials on a common grid'''
+import numpy as np
+from matplotlib import pyplot as plt
+import helper
+from Tomato3_dataStructure import Subject, Experiment
+from Tomato3_batch import filter_groups
+
+# extent in meters of the grid, ((x min, x max), (y min, y max)), in the
+# rotated walking frame and relative to the leader
+ABSOLUTE_EXTENT = ((-3, 3), (-1, 15))
+RELATIVE_EXTENT = ((-3, 3), (-8, 4))
+CELL = 0.1
+
+class DensityGrids:
+    '''
+        Follower occupancy and speed binned on a grid, one grid per group
+        of trials sharing leader and v0.
+        attributes:
+            keys (list): (leader, v0) of each group, sorted.
+            xedges, yedges (1-d np array of float): Cell edges in meters.
+            counts (3-d np array of int): Number of frames in each cell,
+                   with size (groups, x cells, y cells).
+            speeds (3-d np array of float): Sum of the follower speeds of
+                   these frames.
+            trials (1-d np array of int): Number of trials of each group.
+            Hz (float): Sampling rate of the trials.
+            relative (boolean): Whether positions are relative to the leader.
+    '''
+    def __init__(self, keys, xedges, yedges, counts, speeds, trials, Hz, relative):
+        self.keys = keys
+        self.xedges = xedges
+        self.yedges = yedges
+        self.counts = counts
+        self.speeds = speeds
+        self.trials = trials
+        self.Hz = Hz
+        self.relative = relative
+
+    def occupancy(self):
+        '''
+        return the average time in seconds a trial of each group spends in
+        each cell.
+        '''
+        return self.counts / (np.maximum(self.trials, 1)[:, None, None] * float(self.Hz))
+
+    def mean_speed(self):
+        '''
+        return the average follower speed in each cell, nan in cells never
+        visited.
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, self.speeds / self.counts, np.nan)
+
+    def plot(self, value='occupancy', show=True, title=''):
+        '''
+        Draw the grids of every group, leaders by row and v0 by column,
+        on a shared color scale.
+
+        args:
+            value (str): 'occupancy' or 'speed'.
+            show (boolean): Whether show the figure.
+            title (str): Title of the figure.
+        return:
+            The matplotlib Figure.
+        '''
+        if value == 'occupancy':
+            grids, label = self.occupancy(), 's/trial'
+            norm = plt.Normalize(0, max(grids.max(), 1e-9))
+        elif value == 'speed':
+            grids, label = self.mean_speed(), 'm/s'
+            norm = plt.Normalize(0.8, 1.6)
+        else:
+            raise Exception('Unknown density value ' + value)
+        leaders = sorted(set(k[0] for k in self.keys), key=str)
+        v0s = sorted(set(k[1] for k in self.keys))
+        fig, axes = plt.subplots(len(leaders), len(v0s), squeeze=False, sharex=True, sharey=True,
+                                 figsize=(1.6 * len(v0s) + 1.5, 3.6 * len(leaders)))
+        extent = (self.xedges[0], self.xedges[-1], self.yedges[0], self.yedges[-1])
+        for ax in axes.flat:
+            ax.set_visible(False)
+        for g, (leader, v0) in enumerate(self.keys):
+            ax = axes[leaders.index(leader), v0s.index(v0)]
+            ax.set_visible(True)
+            # one image per group whatever the number of trials
+            image = ax.imshow(grids[g].T, origin='lower', extent=extent, norm=norm, cmap='plasma',
+                              interpolation='nearest')
+            ax.set_title(str(leader) + ', v0 = ' + str(v0) + '\n' + str(self.trials[g]) + ' trials', fontsize=8)
+        for ax in axes[-1]:
+            ax.set_xlabel('position x')
+        for ax in axes[:, 0]:
+            ax.set_ylabel('position y relative to leader' if self.relative else 'position y')
+        if self.keys:
+            cb = fig.colorbar(image, ax=axes.ravel().tolist())
+            cb.set_label(label)
+        fig.suptitle(title)
+        if show:
+            plt.show()
+        return fig
+
+def position_batches(trials, chunk=500, **kwargs):
+    '''
+    Filtered follower positions and speeds of many trials in the rotated
+    walking frame, computed <chunk> trials at a time.
+
+    args:
+        trials (list): Instances of the Trial class.
+        chunk (int): Number of trials filtered at once.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
+    return:
+        A generator of (index, pos, spd, lengths). index is the list of
+        positions in <trials> of a batch, pos the x-y positions with size
+        (batch, frames, 2), spd the speeds with size (batch, frames) and
+        lengths the number of frames of each trial; the arrays are padded
+        after the end of each trial.
+    '''
+    for start in range(0, len(trials), chunk):
+        part = trials[start:start + chunk]
+        for index, data, lengths in filter_groups(part, **kwargs):
+            vel = helper.gradient_batch(data[:, :, 0:2], lengths, part[index[0]].Hz)
+            yield [start + i for i in index], data[:, :, 0:2], np.hypot(vel[:, :, 0], vel[:, :, 1]), lengths
+
+def leader_positions(trials, frames):
+    '''
+    return the x-y positions of the leaders of many trials at <frames>, as
+    in get_kinematics('l') from f1 on, with size (trials, frames, 2). The
+    leader walks straight at v0 from its rotated position at f1.
+    '''
+    f1 = np.array([t.f1 for t in trials])[:, None]
+    step = np.array([t.v0 / float(t.Hz) for t in trials])[:, None]
+    start = np.array([t.rotate_data(t.lpos[t.f1:t.f1 + 1])[0, 0:2] for t in trials])
+    pos = np.empty((len(trials), len(frames), 2))
+    pos[:, :, 0] = start[:, 0:1]
+    pos[:, :, 1] = start[:, 1:2] + (frames - f1 + 1) * step
+    return pos
+
+def density_grids(trials, relative=False, cell=CELL, extent=None, chunk=500, **kwargs):
+    '''
+    Bin the filtered follower positions of many trials, in the rotated
+    walking frame, into occupancy and speed grids grouped by leader and v0.
+    Positions are filtered in batches of <chunk> trials and binned with
+    one bincount per batch, so memory does not grow with the number of
+    trials.
+
+    args:
+        trials: An instance of the Experiment or Subject class, whose
+            experimental trials are used, or a list of instances of the
+            Trial class.
+        relative (boolean): Whether bin the position of the follower
+                 relative to the leader, from the leader onset on. Trials
+                 without leader are not allowed then.
+        cell (float): Size in meters of a square cell.
+        extent (tuple): ((x min, x max), (y min, y max)) of the grid,
+               ABSOLUTE_EXTENT or RELATIVE_EXTENT if None.
+        chunk (int): Number of trials filtered at once.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
+    return:
+        An instance of DensityGrids. Positions outside the extent are dropped.
+    '''
+    if isinstance(trials, Experiment):
+        trials = trials.get_trials()
+    elif isinstance(trials, Subject):
+        trials = [trials.trials[j] for j in sorted(trials.trials)]
+    if relative and any(t.leader is None for t in trials):
+        raise Exception('Freewalk trials have no leader to be relative to')
+    if extent is None:
+        extent = RELATIVE_EXTENT if relative else ABSOLUTE_EXTENT
+    (x0, x1), (y0, y1) = extent
+    nx, ny = int(round((x1 - x0) / cell)), int(round((y1 - y0) / cell))
+    keys = sorted(set((t.leader, t.v0) for t in trials), key=lambda k: (str(k[0]), k[1]))
+    group_of = dict((k, g) for g, k in enumerate(keys))
+    size = len(keys) * nx * ny
+    counts, speeds = np.zeros(size, dtype=int), np.zeros(size)
+    Hz = trials[0].Hz if trials else 90
+
+    for index, pos, spd, lengths in position_batches(trials, chunk, **kwargs):
+        group = [trials[i] for i in index]
+        if group[0].Hz != Hz:
+            raise Exception('Trials have different sampling rates')
+        frames = np.arange(pos.shape[1])
+        mask = frames < lengths[:, None]
+        if relative:
+            pos = pos - leader_positions(group, frames)
+            mask &= frames >= np.array([t.f1 for t in group])[:, None]
+        ix = np.floor((pos[:, :, 0] - x0) / (x1 - x0) * nx).astype(int)
+        iy = np.floor((pos[:, :, 1] - y0) / (y1 - y0) * ny).astype(int)
+        mask &= (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        g = np.array([group_of[(t.leader, t.v0)] for t in group])[:, None]
+        cells = ((g * nx + ix) * ny + iy)[mask]
+        counts += np.bincount(cells, minlength=size)
+        speeds += np.bincount(cells, weights=spd[mask], minlength=size)
+
+    ntrials = np.bincount([group_of[(t.leader, t.v0)] for t in trials], minlength=len(keys)).astype(int)
+    shape = (len(keys), nx, ny)
+    return DensityGrids(keys, np.linspace(x0, x1, nx + 1), np.linspace(y0, y1, ny + 1), counts.reshape(shape),
+                        speeds.reshape(shape), ntrials, Hz, relative)
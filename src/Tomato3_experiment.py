@@ -32,6 +32,8 @@ import viztracker
 
 import emergencyWalls
 
+from Tomato3_recorder import FrameRecorder, FrameTimer, TRIAL_FIELDS, FREEWALK_FIELDS
+
 #####################################################################################
 # Constants
 # Set to True when ready to have the experiment write data
@@ -145,7 +147,7 @@ viz.go()
 def goToStage(nextTrialStage):
 	global trial_stage
 	trial_stage = nextTrialStage
-	print 'Going to: ' + trial_stage
+	print('Going to: ' + trial_stage)
 
 	
 def endLine(x):
@@ -329,7 +331,11 @@ time = 0
 instruction = True
 reset_countDown = True
 screenshot = 1
-data_batch = ''
+# per frame data of the current trial, written at its end
+data_batch = FrameRecorder(TRIAL_FIELDS, int_fields=['avatarID'])
+freewalk_batch = FrameRecorder(FREEWALK_FIELDS)
+# frame and loop times, summarized next to the data of each trial
+frame_timer = FrameTimer(HZ)
 leader = None
 leaderSpd = 0
 cur_pos = ''
@@ -355,9 +361,11 @@ def masterLoop(num):
 	# global variables within masterLoop
 	global DATA_COLLECT, DO_PRACTICE, is_practice, is_freewalk, data_collect, trial_stage, trial_num, \
 	freewalk_session, time, time_stamp, cur_pos, conditions, practice_conditions, condition, K, B, _alpha, \
-	reset_countDown, controlType,instruction, screenshot, data_batch, leaderSpd, leader, avatarID,\
+	reset_countDown, controlType,instruction, screenshot, data_batch, freewalk_batch, leaderSpd, leader, avatarID,\
 	time_elapsed, HZ, flag
 
+	frame_timer.begin(trial_stage)
+
 	# Time elapsed since the last run of masterLoop and then added to the global time
 	time_elapsed = viz.getFrameElapsed()
 	time += time_elapsed
@@ -387,10 +395,7 @@ def masterLoop(num):
 		if DATA_COLLECT and data_collect:			
 
 			# Position: Target_x, Target_y, Target_z, Participant_x, Participant_y, Participant_z, Yaw, Pitch, Row, time stamp
-			data = [cur_pos[0], cur_pos[1], cur_pos[2], cur_rot[0], cur_rot[1], cur_rot[2]]
-			strData = [str(round(t,4)) for t in data+[time]]
-			strData = ','.join(strData)+'\n'
-			data_batch = data_batch + strData
+			freewalk_batch.append([cur_pos[0], cur_pos[1], cur_pos[2], cur_rot[0], cur_rot[1], cur_rot[2], time])
 
 		
 		
@@ -398,7 +403,7 @@ def masterLoop(num):
 		# 00 01 Freewalk Pretrial: sets up practice trial, establishes pole locations
 		if trial_stage == 'pretrial_00_01':
 			if flag:
-				print '> Start Free Walking Session ' + str(freewalk_session) + ' Trial ' + str(trial_num) + ' ----------------------------------'
+				print('> Start Free Walking Session ' + str(freewalk_session) + ' Trial ' + str(trial_num) + ' ----------------------------------')
 				flag = False
 		
 			# Set position of home pole (where participant stands to start trial)
@@ -450,7 +455,7 @@ def masterLoop(num):
 		#########
 		# 00 03 Freewalk In Position: proceeds once participant is standing on home and facing orient for three seconds
 		elif (trial_stage == 'inposition_00_03'):
-			print 'Free walk start'
+			print('Free walk start')
 			# Turn off home pole
 			models['homePole'].visible(viz.OFF)
 			models['orientPole'].visible(viz.OFF)
@@ -463,7 +468,8 @@ def masterLoop(num):
 			data_collect = True
 		
 			# initialize batch data output
-			data_batch = ''
+			freewalk_batch.reset()
+			frame_timer.mark()
 			time = 0
 			
 			# Move to Stage 4
@@ -488,19 +494,19 @@ def masterLoop(num):
 			
 			# save the data of this trial
 			fileName = OUTPUT_DIR + NICKNAME + '_freewalk' + '_subj' + subject + '_s' + str(freewalk_session) + '_trial' + str(trial_num).zfill(3) + '.csv'
-			with open(fileName, 'a') as file:
-				file.write(data_batch)
+			freewalk_batch.flush(fileName)
+			frame_timer.flush(fileName)
 
 
-			print 'End Freewalk Trial ' + str(trial_num)
+			print('End Freewalk Trial ' + str(trial_num))
 			data_collect = False
 
 
 			# End Check: When trial_num is greater than FREEWALK_TRIALS, end practice and start experiment block
 			if trial_num == FREEWALK_TRIALS:
-				print '>> End Freewalk Session<<'
+				print('>> End Freewalk Session<<')
 				if freewalk_session == 2:
-					print '>>> End Experiment <<<'
+					print('>>> End Experiment <<<')
 					goToStage('NULL')
 					if instruction:
 						sounds['End'].play()
@@ -528,7 +534,7 @@ def masterLoop(num):
 		# 01 01 Practice Pretrial: sets up practice trial, establishes pole locations
 		if trial_stage == 'pretrial_01_01':
 			if flag:
-				print '> Start Practice Trial ' + str(trial_num) + ' ----------------------------------'
+				print('> Start Practice Trial ' + str(trial_num) + ' ----------------------------------')
 				flag = False
 			# load input
 			if practice_conditions[trial_num][3] == 'avatar':
@@ -591,7 +597,7 @@ def masterLoop(num):
 		# 01 03 Practice In Position: proceeds once participant is standing on home and facing orient for three seconds
 		elif trial_stage == 'inposition_01_03':
 			
-			print 'Practice Target Appears'
+			print('Practice Target Appears')
 			
 			# Turn off home pole and orientation pole
 			models['homePole'].visible(viz.OFF)
@@ -635,12 +641,12 @@ def masterLoop(num):
 			# Clears the target pole
 			leader.visible(viz.OFF)
 
-			print 'End Practice Trial ' + str(trial_num)
+			print('End Practice Trial ' + str(trial_num))
 			
 
 			# End Check: When trial_num is greater than PRACTICE_TRIALS, end practice and start experiment block
 			if trial_num >= PRACTICE_TRIALS:
-				print '>> End Practice <<'
+				print('>> End Practice <<')
 				goToStage('pretrial_02_01')
 				is_practice = False
 				trial_num = 1
@@ -666,10 +672,7 @@ def masterLoop(num):
 			
 			leader_loc = leader.getPosition()
 			# Position: Target_x, Target_y, Target_z, Participant_x, Participant_y, Participant_z, Yaw, Pitch, Row, time stamp
-			data = [leader_loc[0], leader_loc[1], leader_loc[2], cur_pos[0], cur_pos[1], cur_pos[2], cur_rot[0], cur_rot[1], cur_rot[2]]
-			strData = [str(round(t,4)) for t in data+[time]] + [str(avatarID)]
-			strData = ','.join(strData)+'\n'
-			data_batch = data_batch + strData
+			data_batch.append([leader_loc[0], leader_loc[1], leader_loc[2], cur_pos[0], cur_pos[1], cur_pos[2], cur_rot[0], cur_rot[1], cur_rot[2], time, avatarID])
 
 			# log IPD
 			if trial_num == 1:
@@ -686,7 +689,7 @@ def masterLoop(num):
 			
 			# Print start of trial, trial #, and type of trial [pos][speed][turn]
 			if flag:
-				print '> Start Trial ' + str(trial_num) + ': ' + condition + ' ----------------------------------'
+				print('> Start Trial ' + str(trial_num) + ': ' + condition + ' ----------------------------------')
 				flag = False
 			# load input
 			if conditions[trial_num][3] == 'avatar':
@@ -758,7 +761,8 @@ def masterLoop(num):
 			# Move to Stage 5
 			goToStage('target_02_04')
 			# initialize batch data output
-			data_batch = ''
+			data_batch.reset()
+			frame_timer.mark()
 			time = 0
 
 			
@@ -800,10 +804,10 @@ def masterLoop(num):
 			
 			# save the data of this trial			
 			fileName = OUTPUT_DIR + NICKNAME + '_subj' + subject + '_trial' + str(trial_num).zfill(3) + '_' + condition + '.csv'
-			with open(fileName, 'a') as file:
-				file.write(data_batch)
+			data_batch.flush(fileName)
+			frame_timer.flush(fileName)
 	
-			print 'End Trial ' + str(trial_num)
+			print('End Trial ' + str(trial_num))
 			
 			# When trial_num is greater than TOTAL_TRIALS, end experiment
 			if trial_num == TOTAL_TRIALS:
@@ -815,6 +819,8 @@ def masterLoop(num):
 				trial_num += 1
 				goToStage('pretrial_02_01')
 
+	frame_timer.end(time_elapsed)
+
 # Restarts the loop, at a rate of 60Hz
 viz.callback(viz.TIMER_EVENT,masterLoop)
 viz.starttimer(0,1.0/HZ,viz.FOREVER)
@@ -0,0 +1,194 @@
+'''headless batch export of trial figures and videos
+
+Every output is recorded in manifest.csv of the output directory with a
+fingerprint of the trial data, the metadata and the parameters it was
+rendered with. Outputs whose fingerprint did not change are not rendered
+again, so exporting after a change only redraws what it affects.
+'''
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from matplotlib import pyplot as plt
+from Tomato3_dataStructure import Experiment
+from Tomato3_columnar import CHANNELS, TRIAL_COLUMNS
+from Tomato3_batch import select_trials
+from Tomato3_runner import Failure, map_items
+from Tomato3_store import load_experiment
+from Tomato3_summary import trial_summary
+from Tomato3_animation import save_video
+
+# kind of output to file extension
+KINDS = OrderedDict([('trajectory', 'png'), ('speeds', 'png'), ('positions', 'png'), ('video', 'mp4')])
+# parameters the outputs depend on, passed to the plot methods and save_video
+OPTIONS = ['order', 'cutoff', 'backend', 'rotated', 'filtered', 'dpi']
+MANIFEST_COLUMNS = ['file', 'kind', 'subject_id', 'trial_id', 'fingerprint']
+# bump when the drawing code changes so every output is rendered again
+VERSION = 2
+
+def output_name(trial, kind):
+    '''
+    return the file name of an output, e.g. subj03_trial012_speeds.png.
+    '''
+    return 'subj' + str(trial.subject_id).zfill(2) + '_trial' + str(trial.trial_id).zfill(3) + '_' + kind + \
+           '.' + KINDS[kind]
+
+def fingerprint(trial, kind, options):
+    '''
+    return a hash of the frames and metadata of a trial, the kind of
+    output and its options.
+    '''
+    h = hashlib.sha1()
+    for name in CHANNELS:
+        data = getattr(trial, name)
+        h.update(b'-' if data is None else np.ascontiguousarray(data).tobytes())
+    metadata = [getattr(trial, c) for c in TRIAL_COLUMNS] + [VERSION, kind, sorted(options.items())]
+    h.update(repr(metadata).encode())
+    return h.hexdigest()
+
+def render(trial, kind, filename, dpi=100, **kwargs):
+    '''
+    Render one output of a trial to <filename> without showing it.
+
+    Args:
+        trial: An instance of the Trial class.
+        kind (str): One of KINDS.
+        dpi (int): Resolution of figures and videos.
+        kwargs: order, cutoff, backend, rotated, filtered.
+    '''
+    if kind == 'video':
+        save_video(trial, filename, fps=trial.Hz, processes=1, dpi=dpi, **kwargs)
+        return
+    fig = getattr(trial, 'plot_' + kind)(show=False, **kwargs)
+    fig.savefig(filename, dpi=dpi)
+    plt.close(fig)
+
+def _export(item, out_dir, options, fingerprints, force):
+    # runs in the worker, so hashing is parallel too
+    trial, kind = item
+    if plt.get_backend().lower() != 'agg':
+        plt.switch_backend('Agg')
+    name = output_name(trial, kind)
+    fp = fingerprint(trial, kind, options)
+    path = os.path.join(out_dir, name)
+    if not force and fingerprints.get(name) == fp and os.path.isfile(path):
+        return name, fp, False
+    # render next to the output so a crash never leaves half a file
+    tmp = os.path.join(out_dir, 'tmp_' + name)
+    render(trial, kind, tmp, **options)
+    os.replace(tmp, path)
+    return name, fp, True
+
+def read_manifest(out_dir):
+    '''
+    return the manifest of an output directory, empty if there is none.
+    '''
+    path = os.path.join(out_dir, 'manifest.csv')
+    if not os.path.isfile(path):
+        return pd.DataFrame(columns=MANIFEST_COLUMNS)
+    return pd.read_csv(path)
+
+def export_trials(trials, out_dir, kinds=None, processes=None, chunksize=1, force=False, **options):
+    '''
+    Render figures and videos of many trials in worker processes, skipping
+    the outputs that are up to date.
+
+    Args:
+        trials: An instance of the Experiment class, whose experimental
+            trials are used, or a list of instances of the Trial class.
+        out_dir (str): Directory of the outputs and their manifest.
+        kinds (list): Kinds of output, see KINDS, all if None.
+        processes, chunksize: See Tomato3_runner.map_items.
+        force (boolean): Whether render even the outputs that are up to date.
+        options: Any of OPTIONS.
+    Return:
+        A dictionary with the lists of 'rendered' and 'skipped' files and
+        of 'failed' instances of Tomato3_runner.Failure.
+    '''
+    for key in options:
+        if key not in OPTIONS:
+            raise Exception('Unknown export option ' + key)
+    if isinstance(trials, Experiment):
+        trials = trials.get_trials()
+    kinds = list(KINDS) if kinds is None else kinds
+    for kind in kinds:
+        if kind not in KINDS:
+            raise Exception('Unknown kind of output ' + kind)
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    manifest = read_manifest(out_dir)
+    fingerprints = dict(zip(manifest['file'], manifest['fingerprint']))
+    entries = OrderedDict((row['file'], dict(row)) for _, row in manifest.iterrows())
+
+    items = [(t, kind) for t in trials for kind in kinds]
+    report = {'rendered': [], 'skipped': [], 'failed': []}
+    results = map_items(_export, items, processes, chunksize, out_dir=out_dir, options=options,
+                        fingerprints=fingerprints, force=force)
+    for (t, kind), (ok, value) in zip(items, results):
+        name = output_name(t, kind)
+        if not ok:
+            # render it again next time
+            entries.pop(name, None)
+            report['failed'].append(Failure(t.subject_id, t.trial_id, *value))
+            continue
+        name, fp, rendered = value
+        report['rendered' if rendered else 'skipped'].append(name)
+        entries[name] = {'file': name, 'kind': kind, 'subject_id': t.subject_id, 'trial_id': t.trial_id,
+                         'fingerprint': fp}
+
+    path = os.path.join(out_dir, 'manifest.csv')
+    manifest = pd.DataFrame([entries[f] for f in sorted(entries)], columns=MANIFEST_COLUMNS)
+    manifest.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    return report
+
+def select_review(path, overtake=None, valid=None, parameters=None, **criteria):
+    '''
+    return the lazy experimental trials of a store (see Tomato3_store)
+    matching a selection, in the order of Experiment.get_trials.
+
+    Args:
+        path (str): Directory of the store.
+        overtake (boolean): Only overtaking (True) or non overtaking (False)
+                 trials by the 'lateral' column of the trial summary, all
+                 if None.
+        valid (boolean): The same with the 'valid' column.
+        parameters (dict): Parameters of the trial summary, see
+                   Tomato3_summary.trial_summary.
+        criteria: Columns of the trial table and a value or a list of
+            values, e.g. subject_id=[1, 2], v0=1.2, leader='pole'.
+    '''
+    exp = load_experiment(path, lazy=True)
+    trials = select_trials(exp, **criteria)
+    if overtake is None and valid is None:
+        return trials
+    summary = trial_summary(path, **(parameters or {}))
+    flags = dict(((s, i), (l, v)) for s, i, l, v in
+                 zip(summary['subject_id'], summary['trial_id'], summary['lateral'], summary['valid']))
+    selected = []
+    for t in trials:
+        lateral, is_valid = flags[(t.subject_id, t.trial_id)]
+        if overtake is not None and bool(lateral) != overtake:
+            continue
+        if valid is not None and bool(is_valid) != valid:
+            continue
+        selected.append(t)
+    return selected
+
+def export_review(path, out_dir, kinds=None, processes=None, force=False, overtake=None, valid=None, options=None,
+                  **criteria):
+    '''
+    Export the review set of a store in one call, see select_review and
+    export_trials. options is a dictionary of OPTIONS, its filter
+    parameters also apply to the overtake classification.
+    '''
+    options = options or {}
+    parameters = dict((k, options[k]) for k in ['order', 'cutoff', 'backend'] if k in options)
+    trials = select_review(path, overtake, valid, parameters, **criteria)
+    return export_trials(trials, out_dir, kinds, processes, force=force, **options)
+
+if __name__ == '__main__':
+    report = export_review('Tomato3_data', 'Tomato3_review')
+    for key, files in report.items():
+        print(str(len(files)) + ' ' + key)
@@ -12,8 +12,8 @@ def angle_overtake(trial, threshold=55):
         threshold: Angle in degree
     '''
     threshold = np.cos(threshold * np.pi / 180)
-    lpos = trial.get_positions('l')
-    fpos = trial.get_positions('f')
+    lpos = trial.get_kinematics('l').pos
+    fpos = trial.get_kinematics('f').pos
     vec1 = lpos[-1, 0:2] - fpos[-1, 0:2]
     vec0 = [0, 1]
     cos = np.dot(vec0, vec1)/np.linalg.norm(vec1)
@@ -35,9 +35,10 @@ def lateral_overtake(trial, threshold=0.3, window=1):
         threshold: Distance in meter
     '''
     
-    fpos_x = trial.get_positions('f')[:, 0]
+    fkin = trial.get_kinematics('f')
+    fpos_x = fkin.lat_pos
     fpos_x_max = max(abs(fpos_x[trial.f1:]))
-    fspd_y = trial.get_velocities('f')[:, 1]
+    fspd_y = fkin.fwd_vel
     fspd_y_max = helper.max_average(fspd_y, window)
 
     if valid_trial(trial) and fspd_y_max > trial.v0 and fpos_x_max > threshold:
@@ -45,17 +46,23 @@ def lateral_overtake(trial, threshold=0.3, window=1):
     else:
         return False
         
-def overtake_rates(subject, threshold=0.2):
+def overtake_rates(subject, threshold=0.2, v0s=None):
     '''
     return a dictionary. The keys are v0, the values are overtake rates.
     Overtake is labeled by the lateral criterion.
     
     Args:
         subject: An instance of the Subject class
+        v0s (list): Only compute the rates of these v0, None for all. The
+            other trials are not touched, so lazy trials are not loaded.
     '''
     count = {0.8:[0, 0], 0.9:[0, 0], 1.0:[0, 0], 
              1.1:[0, 0], 1.2:[0, 0], 1.3:[0, 0]}
+    if v0s is not None:
+        count = {key: count[key] for key in v0s}
     for i, t in subject.trials.items():
+        if v0s is not None and t.v0 not in v0s:
+            continue
         # only count among valid trials
         if valid_trial(t):
             count[t.v0][0] += 1.0
@@ -74,7 +81,7 @@ def max_freewalk_spd(subject):
     '''
     max_fspd = 0.0
     for i, t in subject.freewalk.items():
-        fspd = t.get_speeds('f')
+        fspd = t.get_kinematics('f').spd
         _max = max(fspd)
         if max_fspd < _max:
             max_fspd = _max
@@ -91,12 +98,12 @@ def average_freewalk_spd(subject, window):
     sum_fspd = 0.0
     num = 0
     for i, t in subject.freewalk.items():
-        fspd = t.get_speeds('f')
+        fspd = t.get_kinematics('f').spd
         sum_fspd += helper.max_average(fspd, window * t.Hz)
         num += 1
     return sum_fspd / num
     
-def overtake_onset(trial, tolerance=0.02):
+def overtake_onset(trial, tolerance=0.02, **kwargs):
     '''
     return the index when participants initiate overtaking, accoding to
     the following criterion: find an interval from leader appear to the
@@ -106,12 +113,14 @@ def overtake_onset(trial, tolerance=0.02):
     
     Args:
         trial: An instance of the Trial class.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
     Return:
         An int as the index of the onset of overtaking
     '''
     l = trial.f1
-    fvel_x = trial.get_velocities('f')[:, 0]
-    fpos_x = trial.get_positions('f')[:, 0]
+    fkin = trial.get_kinematics('f', **kwargs)
+    fvel_x = fkin.lat_vel
+    fpos_x = fkin.lat_pos
     averge_x = helper.running_average(fvel_x)
     
     pos_peak = min(np.argmax(abs(fpos_x)), trial.length - trial.Hz)
@@ -167,7 +176,7 @@ def average_onset_spds(subject):
     '''
     fspds = [0.0] * 6
     for i, t in subject.trials.items():
-        fspds[int(t.v0 * 10 - 8)] += t.get_speeds('f')[t.f1] / 10   
+        fspds[int(t.v0 * 10 - 8)] += t.get_kinematics('f').spd[t.f1] / 10   
     return fspds
     
 def expansion_at(trial, relative, frames=None, w=1.8):
@@ -181,10 +190,12 @@ def expansion_at(trial, relative, frames=None, w=1.8):
         w (float): The size of the leader.
     '''  
     if not frames: frames = list(range(trial.length))
-    lpos = trial.get_positions('l')[frames, 0:2]
-    fpos = trial.get_positions('f')[frames, 0:2]
-    lvel = trial.get_velocities('l')[frames, 0:2]
-    fvel = trial.get_velocities('f')[frames, 0:2]
+    lkin = trial.get_kinematics('l')
+    fkin = trial.get_kinematics('f')
+    lpos = lkin.pos[frames, 0:2]
+    fpos = fkin.pos[frames, 0:2]
+    lvel = lkin.vel[frames, 0:2]
+    fvel = fkin.vel[frames, 0:2]
     return helper.expansions(lpos, fpos, lvel, fvel, relative, w)
     
 def average_expansions(subject, relative, w=1.8):
@@ -212,9 +223,10 @@ def time_to_pass(trial):
     Return:
         An array of time-to-pass.
     '''
-    fspd_y = trial.get_velocities('f')[:, 1]
-    fpos_y = trial.get_positions('f')[:, 1]
-    lpos_y = trial.get_positions('l')[:, 1]
+    fkin = trial.get_kinematics('f')
+    fspd_y = fkin.fwd_vel
+    fpos_y = fkin.fwd_pos
+    lpos_y = trial.get_kinematics('l').fwd_pos
     return helper.time_to_contact(lpos_y, fpos_y, trial.v0, fspd_y)
     
 def valid_trial(trial, threshold=0.2):
@@ -228,7 +240,7 @@ def valid_trial(trial, threshold=0.2):
     Return:
         A boolean representing whether the trial is valid
     '''
-    return abs(trial.get_positions('f')[trial.f1, 0]) < threshold
+    return abs(trial.get_kinematics('f').lat_pos[trial.f1]) < threshold
 
 
 
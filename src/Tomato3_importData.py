@@ -1,91 +1,270 @@
 import numpy as np
 import pandas as pd
 import os
+import shutil
+import hashlib
+from multiprocessing import Pool
 from Tomato3_dataStructure import Trial, Subject, Experiment
-import pickle
+from Tomato3_columnar import TRIAL_COLUMNS, subject_table
+from Tomato3_store import read_tables, write_tables, write_segment, next_segment, remove_unused_segments
 
 Hz = 90
-exp = Experiment()
-for i in range(1,13):
-    exp.subjects[i] = Subject(i)
-    if i%2 == 0:
-        exp.subjects[i].leader = 'avatar'
-    else:
-        exp.subjects[i].leader = 'pole'
-    
-input_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir, 'Tomato3_rawData\Tomato3_input'))
-output_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir, 'Tomato3_rawData\Tomato3_output'))
+N_SUBJECTS = 12
+# number of columns in experimental and freewalk trial files
+TRIAL_FILE_COLUMNS = 11
+FREEWALK_FILE_COLUMNS = 7
+# columns of the manifest of an updated store
+MANIFEST_COLUMNS = ['file', 'size', 'mtime', 'hash', 'kind', 'subject_id', 'trial_id']
+
+def load_csv(path, ncols):
+    '''
+    Read a headerless csv file of numbers with a known number of columns.
+
+    Args:
+        path (str): Path of the file.
+        ncols (int): Number of columns.
+    Return:
+        2-d np array of float with size (rows, ncols).
+    Raise:
+        Exception if the number of values is not a multiple of ncols,
+        e.g. when the last row was truncated.
+    '''
+    with open(path, 'r') as f:
+        text = f.read().strip()
+    data = np.fromstring(text.replace('\n', ','), sep=',')
+    if len(data) % ncols != 0:
+        rows = text.count('\n') + 1 if text else 0
+        raise Exception(path + ' has ' + str(len(data)) + ' values in ' + str(rows) + ' rows, not ' + \
+                        str(ncols) + ' per row')
+    return data.reshape(-1, ncols)
 
-for output_file in os.listdir(output_dir):
-    output_file_path = os.path.join(output_dir, output_file)
+def parse_output_file(path):
+    '''
+    Parse one file of the output directory.
+
+    Args:
+        path (str): Path of an experimental trial, freewalk trial or IPD file.
+    Return:
+        A dictionary with the parsed data, 'kind' is 'trial', 'freewalk'
+        or 'IPD'. None if the file is none of them.
+    '''
+    output_file = os.path.basename(path)
     # import experimental data
     if  'Tomato3_subj' in output_file and '.csv' in output_file:
-        with open(output_file_path, 'r') as f:
-            df = pd.read_csv(f, header=None)
-            lpos = np.array(df.iloc[:, [0,2,1]])
-            fpos = np.array(df.iloc[:, [3,5,4]])
-            fori = np.array(df.iloc[:, 6:9])
-            tstamps = np.array(df.iloc[:, 9])
-            leader_model = np.array(df.iloc[:, 10])
-            subject_id = int(output_file[12:14])
-            trial_id = int(output_file[20:23])
-            v0 = float(output_file[27:30])
-            if output_file[-5] == 'e':
-                leader = 'pole'
-            elif output_file[-5] == 'r':
-                leader = 'avatar'
-            leader_onset = None
-            
-            exp.subjects[subject_id].trials[trial_id] = Trial(subject_id, trial_id, lpos, fpos, fori, \
-                                                                tstamps, v0, leader, leader_onset, leader_model)           
+        data = load_csv(path, TRIAL_FILE_COLUMNS)
+        if output_file[-5] == 'e':
+            leader = 'pole'
+        elif output_file[-5] == 'r':
+            leader = 'avatar'
+        return {'kind': 'trial', 'subject_id': int(output_file[12:14]), 'trial_id': int(output_file[20:23]),
+                'v0': float(output_file[27:30]), 'leader': leader, 'lpos': data[:, [0,2,1]],
+                'fpos': data[:, [3,5,4]], 'fori': data[:, 6:9], 'tstamps': data[:, 9],
+                'leader_model': data[:, 10].astype(int)}
     # import IPD and gender data
-    elif 'IPD' in output_file:    
-        with open(output_file_path, 'r') as f:
-            subject_id = int(output_file[12:14])
-            exp.subjects[subject_id].gender == output_file[19]
-            i = output_file.find('txt')
-            exp.subjects[subject_id].IPD == float(output_file[20:i-1])
+    elif 'IPD' in output_file:
+        i = output_file.find('txt')
+        return {'kind': 'IPD', 'subject_id': int(output_file[12:14]), 'gender': output_file[19],
+                'IPD': float(output_file[20:i-1])}
     # import freewalk data
-    elif 'freewalk' in output_file:
-        with open(output_file_path, 'r') as f:
-            df = pd.read_csv(f, header=None)
-            subject_id = int(output_file[21:23])
-            session = int(output_file[-14])
-            trial_id = int(output_file[-7:-4])
-            v0 = 0
-            leader = leader_onset = leader_model= None
-            fpos = np.array(df.iloc[:,[0,2,1]])
-            lpos = np.tile([0,0,0], (len(fpos), 1))
-            fori = np.array(df.iloc[:,3:6])
-            tstamps = np.array(df.iloc[:,-1])
-            if session == 1:
-                exp.subjects[subject_id].freewalk[trial_id] = Trial(subject_id, trial_id, lpos, fpos, fori, \
-                                                                    tstamps, v0, leader, leader_onset, leader_model)
-            else:
-                trial_id += 4
-                exp.subjects[subject_id].freewalk[trial_id] = Trial(subject_id, trial_id, lpos, fpos, fori, \
-                                                                    tstamps, v0, leader, leader_onset, leader_model)
-# import inputs
-for input_file in os.listdir(input_dir):
-    if 'Tomato3_subject' in input_file:
-        subject_id = int(input_file[-6:-4])
-        if subject_id in exp.subjects and exp.subjects[subject_id].trials != {}:
-            # read experimental trials
-            with open(os.path.join(input_dir, input_file), 'r') as f:
-                df = pd.read_csv(f)
-                for i in range(len(df)):
-                    trial_id = df.iloc[i,0]
-                    leader_onset = df.iloc[i,4]
-                    exp.subjects[subject_id].trials[trial_id].leader_onset = leader_onset
- 
-with open('Tomato3_data.pickle', 'wb') as file:   
-    pickle.dump(exp, file, pickle.HIGHEST_PROTOCOL)
-
-# with open(filename, 'r') as file:
-#     rows = file.read().split('\n')[:-1]
-#     cells = [row.split(',') for row in rows]  
-#     cells = np.array([[float(s) for s in row] for row in cells])
-#     lpos = cells[:,[0,2,1]]
-#     fpos = cells[:,[3,5,4]]
-#     fori = cells[:,6:9]
-#     tstamps = cells[:,-1]
+    elif 'freewalk' in output_file and '.csv' in output_file:
+        data = load_csv(path, FREEWALK_FILE_COLUMNS)
+        session = int(output_file[-14])
+        trial_id = int(output_file[-7:-4])
+        if session != 1:
+            trial_id += 4
+        fpos = data[:, [0,2,1]]
+        return {'kind': 'freewalk', 'subject_id': int(output_file[21:23]), 'trial_id': trial_id,
+                'lpos': np.tile([0,0,0], (len(fpos), 1)), 'fpos': fpos, 'fori': data[:, 3:6],
+                'tstamps': data[:, -1]}
+    return None
+
+def read_leader_onsets(input_dir):
+    '''
+    return a dictionary. The keys are subject ids, the values are
+    dictionaries from trial id to leader onset.
+    '''
+    onsets = {}
+    for input_file in os.listdir(input_dir):
+        if 'Tomato3_subject' in input_file:
+            subject_id = int(input_file[-6:-4])
+            df = pd.read_csv(os.path.join(input_dir, input_file))
+            onsets[subject_id] = dict(zip(df.iloc[:, 0], df.iloc[:, 4]))
+    return onsets
+
+def add_record(exp, record):
+    '''
+    Add a record returned by parse_output_file to the experiment.
+    '''
+    subject_id = record['subject_id']
+    if subject_id not in exp.subjects:
+        exp.subjects[subject_id] = Subject(subject_id, leader='avatar' if subject_id%2 == 0 else 'pole')
+    subject = exp.subjects[subject_id]
+    if record['kind'] == 'trial':
+        subject.trials[record['trial_id']] = Trial(subject_id, record['trial_id'], record['lpos'], record['fpos'], \
+                                                   record['fori'], record['tstamps'], record['v0'], \
+                                                   record['leader'], None, record['leader_model'], Hz=Hz)
+    elif record['kind'] == 'freewalk':
+        subject.freewalk[record['trial_id']] = Trial(subject_id, record['trial_id'], record['lpos'], record['fpos'], \
+                                                     record['fori'], record['tstamps'], 0, None, None, None, Hz=Hz)
+    elif record['kind'] == 'IPD':
+        subject.gender = record['gender']
+        subject.IPD = record['IPD']
+
+def empty_experiment():
+    '''
+    return an Experiment with the subjects of the study and no trials.
+    '''
+    exp = Experiment()
+    for i in range(1, N_SUBJECTS + 1):
+        exp.subjects[i] = Subject(i)
+        if i%2 == 0:
+            exp.subjects[i].leader = 'avatar'
+        else:
+            exp.subjects[i].leader = 'pole'
+    return exp
+
+def parse_files(paths, processes=None, chunksize=8):
+    '''
+    Parse output files, in worker processes unless processes is 1.
+    Yield the record of every path in order, None for unrelated files.
+    '''
+    if processes == 1:
+        for record in map(parse_output_file, paths):
+            yield record
+    else:
+        with Pool(processes) as pool:
+            for record in pool.imap(parse_output_file, paths, chunksize):
+                yield record
+
+def import_experiment(output_dir, input_dir, processes=None, chunksize=8):
+    '''
+    Import all raw data into an Experiment.
+
+    Args:
+        output_dir (str): Directory of trial, freewalk and IPD files.
+        input_dir (str): Directory of the condition files.
+        processes (int): Number of worker processes parsing files. None
+                  uses every core, 1 parses in this process.
+        chunksize (int): Number of files sent to a worker at once.
+    Return:
+        An instance of the Experiment class.
+    '''
+    exp = empty_experiment()
+    paths = [os.path.join(output_dir, f) for f in sorted(os.listdir(output_dir))]
+    # parse in workers, build the experiment here
+    for record in parse_files(paths, processes, chunksize):
+        if record is not None:
+            add_record(exp, record)
+    # import inputs
+    for subject_id, onsets in read_leader_onsets(input_dir).items():
+        if subject_id in exp.subjects:
+            for trial_id, t in exp.subjects[subject_id].trials.items():
+                if trial_id in onsets:
+                    t.leader_onset = onsets[trial_id]
+    return exp
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def update_store(output_dir, input_dir, path, processes=None, chunksize=8):
+    '''
+    Bring a store (see Tomato3_store) up to date with the raw data, parsing
+    only files that are new or changed since the last update. The store
+    keeps a manifest of the size, modification time and content hash of
+    every output file it was built from; files whose size and time are
+    unchanged are not even hashed. Trials of changed files are replaced,
+    trials of deleted files are dropped. Without a manifest the whole
+    store is rebuilt.
+
+    Args:
+        output_dir (str): Directory of trial, freewalk and IPD files.
+        input_dir (str): Directory of the condition files.
+        path (str): Directory of the store.
+        processes, chunksize: See import_experiment.
+    Return:
+        A dictionary with the lists of 'new', 'changed' and 'deleted' files.
+    '''
+    manifest_path = os.path.join(path, 'manifest.csv')
+    if os.path.isfile(manifest_path):
+        manifest = pd.read_csv(manifest_path, keep_default_na=False).set_index('file')
+        trials, subjects = read_tables(path)
+    else:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(os.path.join(path, 'segments'))
+        manifest = pd.DataFrame(columns=MANIFEST_COLUMNS[1:], index=pd.Index([], name='file'))
+        trials, subjects = None, subject_table(empty_experiment())
+
+    # compare the output directory with the manifest
+    entries, parse, report = {}, [], {'new': [], 'changed': [], 'deleted': []}
+    for f in sorted(os.listdir(output_dir)):
+        stat = os.stat(os.path.join(output_dir, f))
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if f in manifest.index:
+            old = manifest.loc[f]
+            if old['size'] == entry['size'] and old['mtime'] == entry['mtime']:
+                entries[f] = dict(old)
+                continue
+            entry['hash'] = file_hash(os.path.join(output_dir, f))
+            if entry['hash'] == old['hash']:
+                # touched but not modified
+                entries[f] = dict(old, mtime=entry['mtime'])
+                continue
+            report['changed'].append(f)
+        else:
+            entry['hash'] = file_hash(os.path.join(output_dir, f))
+            report['new'].append(f)
+        entries[f] = entry
+        parse.append(f)
+    report['deleted'] = [f for f in manifest.index if f not in entries]
+
+    # drop what came from changed and deleted files
+    stale = manifest.loc[report['changed'] + report['deleted']]
+    if trials is not None:
+        keys = set(zip(stale['kind'] == 'freewalk', stale['subject_id'], stale['trial_id']))
+        drop = [key in keys for key in zip(trials['freewalk'], trials['subject_id'], trials['trial_id'])]
+        trials = trials[~np.array(drop, dtype=bool)]
+    for subject_id in stale.loc[stale['kind'] == 'IPD', 'subject_id']:
+        subjects.loc[subjects['id'] == subject_id, ['gender', 'IPD']] = np.nan
+
+    # parse new and changed files into a new segment
+    exp = Experiment()
+    paths = [os.path.join(output_dir, f) for f in parse]
+    for f, record in zip(parse, parse_files(paths, processes, chunksize)):
+        entries[f].update(kind='none', subject_id=-1, trial_id=-1)
+        if record is not None:
+            entries[f].update(kind=record['kind'], subject_id=record['subject_id'],
+                              trial_id=record.get('trial_id', -1))
+            add_record(exp, record)
+    if exp.get_trials(freewalk=True):
+        table = write_segment(path, next_segment(path), exp)
+        trials = table if trials is None or len(trials) == 0 else pd.concat([trials, table], ignore_index=True)
+    for i, s in exp.subjects.items():
+        if i not in subjects['id'].values:
+            subjects = pd.concat([subjects, subject_table(Experiment(subjects={i: s}))], ignore_index=True)
+        elif s.IPD is not None:
+            subjects.loc[subjects['id'] == i, ['gender', 'IPD']] = [s.gender, s.IPD]
+    if trials is None:
+        trials = pd.DataFrame(columns=TRIAL_COLUMNS + ['freewalk', 'has_leader_model', 'segment', 'offset'])
+
+    # condition files are small, always read them again
+    onsets = read_leader_onsets(input_dir)
+    for i in trials.index[~trials['freewalk'].astype(bool)]:
+        subject_id, trial_id = trials.at[i, 'subject_id'], trials.at[i, 'trial_id']
+        if trial_id in onsets.get(subject_id, {}):
+            trials.at[i, 'leader_onset'] = onsets[subject_id][trial_id]
+
+    write_tables(path, trials, subjects)
+    remove_unused_segments(path, trials['segment'].unique())
+    manifest = pd.DataFrame([dict(entries[f], file=f) for f in sorted(entries)], columns=MANIFEST_COLUMNS)
+    manifest.to_csv(manifest_path + '.tmp', index=False)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return report
+
+if __name__ == '__main__':
+    input_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir, 'Tomato3_rawData', 'Tomato3_input'))
+    output_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir, 'Tomato3_rawData', 'Tomato3_output'))
+    report = update_store(output_dir, input_dir, 'Tomato3_data')
+    for key, files in report.items():
+        print(str(len(files)) + ' ' + key + ' files')
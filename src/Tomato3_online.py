@@ -0,0 +1,199 @@
+'''causal kinematics and overtake detection, one frame at a time
+
+Written to run both here and inside the experiment (Python 2 under
+Vizard), so it only depends on numpy and scipy.signal.
+'''
+from collections import deque
+import numpy as np
+from scipy.signal import butter, sosfilt_zi, group_delay, sos2tf
+
+THETA = np.arctan(9.0/11) # The smaller angle of the diagonal of the walking space
+HOMEPOLE = np.array([-4.5, -5.5])
+
+def rotate_point(pos, trial_id, theta=THETA):
+    '''
+    Rotate one x-y position like Trial.rotate_data, so that the y axis
+    points from homepole to target door.
+    '''
+    xy = np.asarray(pos[0:2], dtype=float)
+    if trial_id%2 == 0:
+        xy = -xy
+    xy = xy - HOMEPOLE
+    R = np.array([[np.cos(theta), np.sin(theta)],
+                  [-np.sin(theta), np.cos(theta)]])
+    return np.dot(xy, R)
+
+class CausalFilter:
+    '''
+        Butterworth low pass filter applied one sample at a time, as
+        second-order sections in transposed direct form II. Unlike the
+        zero-phase filters of the offline analysis it only uses past
+        samples, so its output lags the input.
+        args:
+            channels (int): Number of values per sample.
+        attributes:
+            delay (float): Lag of slow movements in frames, the group
+                  delay at zero frequency.
+    '''
+    def __init__(self, order, cutoff, Hz, channels=2):
+        self.sos = butter(order, cutoff / (Hz / 2.0), output='sos')
+        self.channels = channels
+        self.state = None
+        self.delay = group_delay(sos2tf(self.sos), [0])[1][0]
+
+    def update(self, x):
+        '''
+        return the filtered value of sample x, an array of <channels> values.
+        '''
+        x = np.asarray(x, dtype=float)
+        if self.state is None:
+            # start in the steady state of the first sample, no transient
+            self.state = sosfilt_zi(self.sos)[:, :, None] * x
+        for s, (b0, b1, b2, a0, a1, a2) in enumerate(self.sos):
+            z = self.state[s]
+            y = b0*x + z[0]
+            z[0] = b1*x - a1*y + z[1]
+            z[1] = b2*x - a2*y
+            x = y
+        return x
+
+class OnlineDetector:
+    '''
+        Streaming kinematics of the follower in one trial and live overtake
+        events by the criteria of Tomato3_helper: valid_trial,
+        lateral_overtake and overtake_onset. Every update costs the same
+        whatever the length of the trial.
+        Events are (name, frame) tuples:
+            'leader': the leader appears, frame is f1.
+            'onset': the follower deviates laterally by onset_threshold
+                     after f1, frame is the onset by the rule of
+                     overtake_onset on the frames so far, moved back by
+                     the delay of the causal filter.
+            'overtake': lateral_overtake holds, frame is the current frame.
+        args:
+            trial_id (int): Decides the walking direction, see Trial.rotate_data.
+            v0 (float): Leader speed.
+            threshold, valid_threshold, window, tolerance: See
+                lateral_overtake, valid_trial and overtake_onset, window is
+                in frames.
+            onset_threshold (float): Lateral deviation in meters that
+                triggers the onset event.
+        attributes:
+            frame (int): Number of frames seen minus one.
+            f1 (int): Frame when the leader appears, None before.
+            pos, vel (1-d np array): Filtered rotated x-y position and
+                velocity of the follower at the current frame.
+            events (list): All events so far.
+    '''
+    def __init__(self, trial_id, v0, Hz=90, order=4, cutoff=0.6, threshold=0.3, valid_threshold=0.2, window=1,
+                 tolerance=0.02, onset_threshold=0.1):
+        self.trial_id = trial_id
+        self.v0 = v0
+        self.Hz = Hz
+        self.threshold = threshold
+        self.valid_threshold = valid_threshold
+        self.tolerance = tolerance
+        self.onset_threshold = onset_threshold
+        self.filter = CausalFilter(order, cutoff, Hz)
+        self.frame = -1
+        self.f1 = None
+        self.valid = None
+        self.lpos0 = None
+        self.pos = None
+        self.vel = np.zeros(2)
+        self.events = []
+        # running lateral statistics
+        self.lat_max = 0.0 # maximum absolute lateral position after f1
+        self.lat_vel_sum = 0.0 # for the running average of lateral velocity
+        self.lat_vel_peak = -1.0
+        self.near_zero = None # whether lateral velocity is within tolerance of zero
+        self.near_average = None # ... of its running average
+        self.last_zero = 0 # frame of the last crossing of the tolerance band
+        self.last_average = 0
+        self.onset_at_peak = 0 # onset candidate at the lateral speed peak
+        # running windowed forward velocity
+        self.fwd_window = deque(maxlen=window)
+        self.fwd_sum = 0.0
+        self.fwd_vel_max = -np.inf
+        self.onset = None
+        self.overtake = None
+
+    def update(self, lpos, fpos):
+        '''
+        Add one frame.
+        
+        Args:
+            lpos, fpos: Raw leader and follower positions, x and y in the
+                horizontal plane as in Trial.lpos and Trial.fpos.
+        Return:
+            The list of events of this frame.
+        '''
+        self.frame += 1
+        frame = self.frame
+        new = []
+        if self.lpos0 is None:
+            self.lpos0 = np.array(lpos, dtype=float)
+        elif self.f1 is None and (np.asarray(lpos, dtype=float) != self.lpos0).any():
+            self.f1 = frame
+            new.append(('leader', frame))
+
+        pos = self.filter.update(rotate_point(fpos, self.trial_id))
+        if self.pos is not None:
+            self.vel = (pos - self.pos) * self.Hz
+        self.pos = pos
+        lat_pos, lat_vel, fwd_vel = pos[0], self.vel[0], self.vel[1]
+
+        # overtake_onset: last crossings before the peak of lateral speed
+        self.lat_vel_sum += lat_vel
+        near_zero = abs(lat_vel) < self.tolerance
+        near_average = abs(lat_vel - self.lat_vel_sum / (frame + 1)) < self.tolerance
+        if abs(lat_vel) > self.lat_vel_peak:
+            self.lat_vel_peak = abs(lat_vel)
+            self.onset_at_peak = max(self.last_zero, self.last_average)
+        if frame > 0:
+            if near_zero != self.near_zero:
+                self.last_zero = frame - 1
+            if near_average != self.near_average:
+                self.last_average = frame - 1
+        self.near_zero, self.near_average = near_zero, near_average
+
+        if len(self.fwd_window) == self.fwd_window.maxlen:
+            self.fwd_sum -= self.fwd_window[0]
+        self.fwd_window.append(fwd_vel)
+        self.fwd_sum += fwd_vel
+        if len(self.fwd_window) == self.fwd_window.maxlen:
+            self.fwd_vel_max = max(self.fwd_vel_max, self.fwd_sum / len(self.fwd_window))
+
+        if self.f1 is not None:
+            if self.valid is None:
+                self.valid = abs(lat_pos) < self.valid_threshold
+            self.lat_max = max(self.lat_max, abs(lat_pos))
+            if self.valid and self.onset is None and self.lat_max > self.onset_threshold:
+                self.onset = max(self.f1, self.onset_at_peak - int(round(self.filter.delay)))
+                new.append(('onset', self.onset))
+            if self.valid and self.overtake is None and self.lat_max > self.threshold \
+               and max(self.fwd_vel_max, 0) > self.v0:
+                self.overtake = frame
+                new.append(('overtake', frame))
+        self.events += new
+        return new
+
+def replay(path, **kwargs):
+    '''
+    Feed a recorded trial file to an OnlineDetector frame by frame.
+    
+    Args:
+        path (str): Path of an experimental trial file.
+        kwargs: Arguments of OnlineDetector.
+    Return:
+        The OnlineDetector after the last frame.
+    '''
+    # imported here to keep this module light for the experiment
+    from Tomato3_importData import parse_output_file
+    record = parse_output_file(path)
+    if record is None or record['kind'] != 'trial':
+        raise Exception('Not an experimental trial file: ' + path)
+    detector = OnlineDetector(record['trial_id'], record['v0'], **kwargs)
+    for lpos, fpos in zip(record['lpos'], record['fpos']):
+        detector.update(lpos, fpos)
+    return detector
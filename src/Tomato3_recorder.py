@@ -0,0 +1,202 @@
+'''per frame data recording for the experiment
+
+Imported by Tomato3_experiment, so it stays Python 2 compatible.
+'''
+import threading
+import time
+from timeit import default_timer
+import numpy as np
+
+# columns of the output files of experimental and freewalk trials
+TRIAL_FIELDS = ['leader_x', 'leader_y', 'leader_z', 'x', 'y', 'z', 'yaw', 'pitch', 'roll', 'time', 'avatarID']
+FREEWALK_FIELDS = ['x', 'y', 'z', 'yaw', 'pitch', 'roll', 'time']
+
+class FrameRecorder:
+    '''
+        Records one row of numbers per frame into a preallocated array,
+        without formatting anything until the trial ends. The array doubles
+        when full, so appending costs constant time on average; with a
+        capacity covering the longest trial it never grows at all.
+        args:
+            fields (list): Column names.
+            capacity (int): Number of rows preallocated.
+            int_fields (list): Columns written as integers by to_csv.
+            decimals (int): Rounding of the other columns by to_csv.
+        attributes:
+            n (int): Number of rows recorded.
+            exports (list): Threads writing csv files in the background.
+    '''
+    def __init__(self, fields, capacity=90*60, int_fields=None, decimals=4):
+        self.fields = list(fields)
+        self.int_fields = list(int_fields) if int_fields is not None else []
+        self.decimals = decimals
+        self.buffer = np.empty((capacity, len(self.fields)))
+        self.n = 0
+        self.exports = []
+
+    def __len__(self):
+        return self.n
+
+    def append(self, row):
+        '''
+        Record one frame, a sequence of values in the order of fields.
+        '''
+        if self.n == len(self.buffer):
+            self.buffer = np.concatenate((self.buffer, np.empty(self.buffer.shape)))
+        self.buffer[self.n] = row
+        self.n += 1
+
+    def reset(self):
+        '''
+        Forget all rows, keeping the buffer for the next trial.
+        '''
+        self.n = 0
+
+    def data(self):
+        '''
+        return the recorded rows, a view into the buffer.
+        '''
+        return self.buffer[:self.n]
+
+    def save(self, fileName):
+        '''
+        Write the recorded rows as a binary .npy file of float64.
+        '''
+        np.save(fileName, self.data())
+
+    def to_csv(self, fileName, mode='a', data=None):
+        '''
+        Write the recorded rows, or <data>, as a headerless csv file,
+        formatted like the experiment always did: every value rounded to
+        <decimals> and printed by str, integer columns printed as integers.
+        '''
+        data = self.data() if data is None else data
+        is_int = [f in self.int_fields for f in self.fields]
+        lines = []
+        for k, row in enumerate(data.tolist()):
+            lines.append(','.join([str(int(v)) if i else str(round(v, self.decimals)) for v, i in zip(row, is_int)]))
+            if k % 32 == 31:
+                # give the interpreter back to the frame loop when in a thread
+                time.sleep(0)
+        with open(fileName, mode) as file:
+            file.write(''.join([line + '\n' for line in lines]))
+
+    def flush(self, fileName, csv=True, background=True):
+        '''
+        Save the trial at its end: the binary file next to <fileName>
+        with the extension .npy, and the csv file unless csv is False.
+        Formatting the csv takes several frames worth of time, so by
+        default it is written by a background thread from a copy of the
+        rows. Then reset for the next trial.
+        '''
+        self.save(fileName.rsplit('.', 1)[0] + '.npy')
+        if csv and background:
+            export = threading.Thread(target=self.to_csv, args=(fileName, 'a', self.data().copy()))
+            export.start()
+            self.exports = [t for t in self.exports if t.is_alive()] + [export]
+        elif csv:
+            self.to_csv(fileName)
+        self.reset()
+
+    def wait(self):
+        '''
+        Wait until all background csv exports are written.
+        '''
+        for export in self.exports:
+            export.join()
+        self.exports = []
+
+class FrameTimer:
+    '''
+        Per frame timing of the experiment loop in a fixed-size ring
+        buffer: the frame time reported by Vizard, the time spent in the
+        loop itself and the trial stage. Nothing is allocated per frame.
+        args:
+            Hz (float): Target frame rate.
+            capacity (int): Number of frames kept, older ones are overwritten.
+            late (float): A frame is dropped when its frame time exceeds
+                  late / Hz.
+        attributes:
+            stages (list): Stage names, the stage column holds their index.
+    '''
+    def __init__(self, Hz=90, capacity=90*120, late=1.5):
+        self.Hz = Hz
+        self.late = late
+        self.buffer = np.zeros((capacity, 3)) # elapsed, loop, stage
+        self.n = 0 # frames recorded so far, the next row is n % capacity
+        self.start = 0 # frame at which the current trial started
+        self.stages = []
+        self._stage_index = {}
+        self._begin = None
+        self._stage = 0
+
+    def begin(self, stage):
+        '''
+        Call at the start of the loop with the current trial stage.
+        '''
+        self._begin = default_timer()
+        if stage not in self._stage_index:
+            self._stage_index[stage] = len(self.stages)
+            self.stages.append(stage)
+        self._stage = self._stage_index[stage]
+
+    def end(self, elapsed):
+        '''
+        Call at the end of the loop with the frame time of this frame.
+        '''
+        row = self.buffer[self.n % len(self.buffer)]
+        row[0] = elapsed
+        row[1] = default_timer() - self._begin
+        row[2] = self._stage
+        self.n += 1
+
+    def mark(self):
+        '''
+        Start a new trial, summaries cover the frames from here on.
+        '''
+        self.start = self.n
+
+    def frames(self):
+        '''
+        return the rows of the current trial, at most capacity of them,
+        oldest first.
+        '''
+        first = max(self.start, self.n - len(self.buffer))
+        index = np.arange(first, self.n) % len(self.buffer)
+        return self.buffer[index]
+
+    def summary(self):
+        '''
+        return a list of (name, value) summarizing the current trial: the
+        number of frames, p50, p99 and max of frame time and loop time in
+        seconds, the number of dropped frames and of missed frames (frames
+        the display had to repeat, from the length of the late ones).
+        '''
+        frames = self.frames()
+        if len(frames) == 0:
+            frames = np.zeros((1, 3))
+        elapsed, loop = frames[:, 0], frames[:, 1]
+        missed = np.maximum(np.round(elapsed * self.Hz) - 1, 0)
+        return [('frames', len(frames)),
+                ('elapsed_p50', np.percentile(elapsed, 50)), ('elapsed_p99', np.percentile(elapsed, 99)),
+                ('elapsed_max', elapsed.max()),
+                ('loop_p50', np.percentile(loop, 50)), ('loop_p99', np.percentile(loop, 99)),
+                ('loop_max', loop.max()),
+                ('dropped', int((elapsed > self.late / self.Hz).sum())), ('missed', int(missed.sum()))]
+
+    def flush(self, fileName):
+        '''
+        Write the timing of the current trial next to its data file
+        <fileName>: the summary as '<name>_timing.txt', two csv lines of
+        names and values, and every frame as '<name>_timing.npy' with
+        columns frame time, loop time and stage index. Stage names are
+        appended to the summary. Then start a new trial.
+        '''
+        base = fileName.rsplit('.', 1)[0] + '_timing'
+        summary = self.summary()
+        names = [name for name, value in summary] + ['stages']
+        values = [str(round(value, 6)) for name, value in summary] + [' '.join(self.stages)]
+        with open(base + '.txt', 'w') as file:
+            file.write(','.join(names) + '\n' + ','.join(values) + '\n')
+        np.save(base + '.npy', self.frames())
+        self.mark()
@@ -0,0 +1,278 @@
+'''replay recorded trials through the master loop of Tomato3_experiment
+
+The experiment runs inside Vizard. Here its modules (viz, vizact,
+viztracker, steamvr, lights, emergencyWalls) are replaced by stubs whose
+head tracker returns recorded poses, so masterLoop can be run and timed
+frame by frame on any machine.
+'''
+import os
+import io
+import sys
+import shutil
+import tempfile
+import timeit
+import threading
+import tracemalloc
+import types
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+from Tomato3_importData import load_csv, TRIAL_FILE_COLUMNS
+
+HZ = 90
+FRAME_BUDGET = 1.0 / HZ
+EXPERIMENT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tomato3_experiment.py')
+STUB_MODULES = ['viz', 'vizact', 'viztracker', 'steamvr', 'lights', 'emergencyWalls']
+
+class Node:
+    '''
+        Stub of a Vizard node: a model, an avatar or a sound.
+    '''
+    def __init__(self, name=''):
+        self.name = name
+        self.position = [0.0, 0.0, 0.0]
+        self.shown = True
+
+    def setPosition(self, pos):
+        self.position = [float(x) for x in pos]
+
+    def getPosition(self):
+        return list(self.position)
+
+    def visible(self, state):
+        self.shown = bool(state)
+
+    def getVisible(self):
+        return self.shown
+
+    def _ignore(self, *args, **kwargs):
+        pass
+
+    setScale = alpha = lookAt = state = speed = play = _ignore
+
+class Tracker:
+    '''
+        The head of the participant. The replay sets pos (x, height, z)
+        and ori (yaw, pitch, roll) before every frame.
+    '''
+    def __init__(self):
+        self.pos = [0.0, 1.6, 0.0]
+        self.ori = [0.0, 0.0, 0.0]
+        self.elapsed = FRAME_BUDGET
+
+    def getSensor(self):
+        return self
+
+def stub_modules(tracker, subject_id, IPD=0):
+    '''
+    return a dictionary from module name to stub module for the imports
+    of Tomato3_experiment, answering its dialogs with the HMD, the subject
+    and the IPD.
+    '''
+    viz = types.ModuleType('viz')
+    viz.ON, viz.OFF = True, False
+    viz.HEAD_POS, viz.HEAD_ORI = 'HEAD_POS', 'HEAD_ORI'
+    viz.ABS_GLOBAL, viz.TIMER_EVENT, viz.FOREVER = 'ABS_GLOBAL', 'TIMER_EVENT', -1
+    viz.MainView = Node('MainView')
+    viz.window = types.SimpleNamespace(screenCapture=lambda *args: None)
+    viz.input = lambda prompt, default='': IPD if 'IPD' in prompt else str(subject_id)
+    viz.choose = lambda prompt, options: 0 # the HMD
+    viz.get = lambda key: list(tracker.pos) if key == viz.HEAD_POS else list(tracker.ori)
+    viz.getFrameElapsed = lambda: tracker.elapsed
+    viz.add = viz.addAudio = Node
+    viz.link = viz.clip = viz.go = viz.clearcolor = viz.callback = viz.starttimer = lambda *args, **kwargs: None
+    vizact = types.ModuleType('vizact')
+    vizact.onkeydown = lambda *args: None
+    viztracker = types.ModuleType('viztracker')
+    viztracker.Keyboard6DOF = lambda: tracker
+    steamvr = types.ModuleType('steamvr')
+    steamvr.HMD = lambda: tracker
+    lights = types.ModuleType('lights')
+    emergencyWalls = types.ModuleType('emergencyWalls')
+    emergencyWalls.popWalls = lambda pos: None
+    return {'viz': viz, 'vizact': vizact, 'viztracker': viztracker, 'steamvr': steamvr, 'lights': lights,
+            'emergencyWalls': emergencyWalls}
+
+def _open(path, mode='r', *args, **kwargs):
+    # the experiment reads its csv files in binary mode, as Python 2 needs
+    if mode == 'rb':
+        return open(path, 'r', newline='')
+    return open(path, mode, *args, **kwargs)
+
+def _prepare_workdir(workdir, namespace, input_dir, subject_id):
+    '''
+    Create the input and output directories of the experiment in <workdir>
+    and copy the condition files of the subject.
+    '''
+    inputs = os.path.join(workdir, namespace['INPUT_DIR'])
+    os.makedirs(os.path.join(workdir, namespace['OUTPUT_DIR']))
+    os.makedirs(inputs)
+    conditions = os.path.join(input_dir, 'Tomato3_subject' + str(subject_id).zfill(2) + '.csv')
+    shutil.copy(conditions, inputs)
+    for leader in ['avatar', 'pole']:
+        practice = os.path.join(input_dir, 'Tomato3_practice_' + leader + '.csv')
+        # practice is not replayed, any condition file will do
+        shutil.copy(practice if os.path.isfile(practice) else conditions,
+                    os.path.join(inputs, 'Tomato3_practice_' + leader + '.csv'))
+
+def load_experiment_loop(tracker, subject_id, input_dir, workdir, path=EXPERIMENT_FILE, **constants):
+    '''
+    Run the module level code of the experiment with stub modules in
+    <workdir> and return its namespace, which holds masterLoop.
+    
+    Args:
+        tracker: An instance of Tracker.
+        subject_id (int): The subject whose condition file is read.
+        input_dir (str): Directory of the condition files, copied into
+                  the Data/ tree the experiment creates in <workdir>.
+        workdir (str): Working directory of the experiment.
+        path (str): Path of the experiment script.
+        constants: Overridden module constants, e.g. START_ON_TRIAL=5.
+    '''
+    with open(path, encoding='utf-8-sig') as f:
+        lines = f.read().splitlines()
+    # the constants end where the settings dialogs start: run up to there,
+    # override the constants and create the directories, then run the rest
+    split = [i for i, line in enumerate(lines) if line.startswith('IPD = viz.input')][0]
+    head = compile('\n'.join(lines[:split]), path, 'exec')
+    tail = compile('\n' * split + '\n'.join(lines[split:]), path, 'exec')
+    namespace = {'__name__': 'Tomato3_experiment', 'open': _open}
+    saved = {name: sys.modules.get(name) for name in STUB_MODULES}
+    cwd = os.getcwd()
+    # the experiment imports modules from its own directory
+    if os.path.dirname(os.path.abspath(path)) not in sys.path:
+        sys.path.append(os.path.dirname(os.path.abspath(path)))
+    sys.modules.update(stub_modules(tracker, subject_id))
+    try:
+        os.chdir(workdir)
+        with redirect_stdout(io.StringIO()):
+            exec(head, namespace)
+            namespace.update(constants)
+            _prepare_workdir(workdir, namespace, input_dir, subject_id)
+            exec(tail, namespace)
+    finally:
+        os.chdir(cwd)
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+    return namespace
+
+def recorded_trials(output_dir, subject_id):
+    '''
+    return a dictionary from trial id to the recorded head poses of the
+    experimental trials of a subject, an array with columns x, height, z,
+    yaw, pitch, roll and time as written by the experiment.
+    '''
+    trials = {}
+    prefix = 'Tomato3_subj' + str(subject_id).zfill(2) + '_trial'
+    for f in sorted(os.listdir(output_dir)):
+        if f.startswith(prefix) and f.endswith('.csv'):
+            data = load_csv(os.path.join(output_dir, f), TRIAL_FILE_COLUMNS)
+            trials[int(f[20:23])] = data[:, 3:10]
+    return trials
+
+def replay(output_dir, input_dir, subject_id, trials=None, memory=True, max_frames=None, keep=False,
+           path=EXPERIMENT_FILE):
+    '''
+    Replay recorded experimental trials through masterLoop at 90 Hz and
+    measure every frame. Before each trial the participant stands on the
+    home pole facing the orient pole until the loop starts the trial, then
+    the recorded poses are fed one per frame. If the loop has not ended
+    the trial when the recording runs out, the participant jumps to the
+    target pole.
+    
+    Args:
+        output_dir (str): Directory of the recorded trial files.
+        input_dir (str): Directory of the condition files.
+        subject_id (int): Subject to replay.
+        trials (list): Trial ids to replay in increasing order, None for all.
+        memory (boolean): Whether trace memory allocations, which makes
+               every frame slower.
+        max_frames (int): Stop after this many frames.
+        keep (boolean): Whether keep the working directory with the files
+             written by the experiment, see the 'workdir' of the report.
+        path (str): Path of the experiment script.
+    Return:
+        frames (pandas DataFrame): One row per frame with trial, stage,
+        recorded frame, seconds spent in masterLoop and, with memory, the
+        bytes allocated by python at the end of the frame and their change
+        during the frame.
+        report (dict): Summary of the frame times: mean, p50, p99, max,
+        'over_budget' frames slower than 1/90 s, 'budget', 'workdir' and,
+        with memory, the largest 'memory' and 'growth' of a frame.
+    '''
+    recordings = recorded_trials(output_dir, subject_id)
+    ids = sorted(recordings) if trials is None else list(trials)
+    tracker = Tracker()
+    workdir = tempfile.mkdtemp(prefix='Tomato3_replay_')
+    loop = load_experiment_loop(tracker, subject_id, input_dir, workdir, path, DATA_COLLECT=True, DO_PRACTICE=False,
+                                DO_FREEWALK=False, START_ON_TRIAL=ids[0])
+    records, timer, frame = [], timeit.default_timer, None
+    cwd = os.getcwd()
+    if memory:
+        tracemalloc.start()
+    try:
+        os.chdir(workdir)
+        out = io.StringIO()
+        while len(records) != max_frames:
+            trial_id = loop['trial_num']
+            home, orient = loop['HOME_POLE'][trial_id%2], loop['HOME_POLE'][(trial_id+1)%2]
+            poses = recordings[trial_id]
+            if not loop['data_collect']:
+                # wait on the home pole facing the orient pole
+                tracker.pos, tracker.elapsed = [home[0], 1.6, home[2]], FRAME_BUDGET
+                yaw = 180.0/np.pi*loop['relativeOrientation'](home, orient)
+                tracker.ori = [(yaw + 180) % 360 - 180, 0.0, 0.0]
+                frame = None
+            else:
+                frame = 0 if frame is None else frame + 1
+                if frame < len(poses):
+                    tracker.pos, tracker.ori = list(poses[frame, 0:3]), list(poses[frame, 3:6])
+                    tracker.elapsed = FRAME_BUDGET if frame == 0 else poses[frame, 6] - poses[frame - 1, 6]
+                else:
+                    tracker.pos, tracker.elapsed = [orient[0], 1.6, orient[2]], FRAME_BUDGET
+            stage = loop['trial_stage']
+            with redirect_stdout(out):
+                start = timer()
+                loop['masterLoop'](0)
+                seconds = timer() - start
+            record = {'trial': trial_id, 'stage': stage, 'frame': frame, 'seconds': seconds}
+            if memory:
+                record['memory'] = tracemalloc.get_traced_memory()[0]
+                record['growth'] = record['memory'] - (records[-1]['memory'] if records else 0)
+            records.append(record)
+            if loop['trial_num'] != trial_id:
+                # trial ended
+                frame = None
+                if trial_id == ids[-1]:
+                    break
+                loop['trial_num'] = ids[ids.index(trial_id) + 1]
+    finally:
+        # files may still be written in the background
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and not thread.daemon:
+                thread.join()
+        os.chdir(cwd)
+        if memory:
+            tracemalloc.stop()
+        if not keep:
+            shutil.rmtree(workdir)
+    frames = pd.DataFrame(records)
+    seconds = frames['seconds'].values
+    report = {'frames': len(frames), 'mean': seconds.mean(), 'p50': np.percentile(seconds, 50),
+              'p99': np.percentile(seconds, 99), 'max': seconds.max(),
+              'over_budget': int((seconds > FRAME_BUDGET).sum()), 'budget': FRAME_BUDGET,
+              'workdir': workdir if keep else None}
+    if memory:
+        report['memory'] = int(frames['memory'].max())
+        report['growth'] = int(frames['growth'].values[1:].max())
+    return frames, report
+
+if __name__ == '__main__':
+    output_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir, 'Tomato3_rawData', 'Tomato3_output'))
+    input_dir = os.path.abspath(os.path.join(os.getcwd(), os.pardir, 'Tomato3_rawData', 'Tomato3_input'))
+    frames, report = replay(output_dir, input_dir, int(sys.argv[1]) if len(sys.argv) > 1 else 1)
+    for key, value in report.items():
+        print(key + ': ' + str(value))
@@ -0,0 +1,157 @@
+'''run analysis functions over an experiment in worker processes'''
+import traceback
+from collections import OrderedDict
+from multiprocessing import Pool
+from Tomato3_dataStructure import Experiment
+from Tomato3_helper import overtake_rates, average_onset_delays, average_onset_spds, max_freewalk_spd, \
+                           average_freewalk_spd
+
+# per subject analyses of subject_report, name to function and keyword arguments
+SUBJECT_ANALYSES = OrderedDict([
+    ('overtake_rates', (overtake_rates, {})),
+    ('average_onset_delays', (average_onset_delays, {})),
+    ('average_onset_spds', (average_onset_spds, {})),
+    ('max_freewalk_spd', (max_freewalk_spd, {})),
+    ('average_freewalk_spd', (average_freewalk_spd, {'window': 1})),
+])
+
+class Failure:
+    '''
+        An error raised by an analysis function on one subject or trial.
+        attributes:
+            subject_id (int)
+            trial_id (int): None when a per subject function failed.
+            error (str): The exception.
+            traceback (str): Formatted traceback from the worker.
+    '''
+    def __init__(self, subject_id, trial_id, error, traceback):
+        self.subject_id = subject_id
+        self.trial_id = trial_id
+        self.error = error
+        self.traceback = traceback
+
+    def __repr__(self):
+        where = 'subject ' + str(self.subject_id)
+        if self.trial_id is not None:
+            where += ' trial ' + str(self.trial_id)
+        return 'Failure(' + where + ': ' + self.error + ')'
+
+def _call(task):
+    # runs in the worker, exceptions are returned rather than raised so
+    # one bad trial does not stop the others
+    func, item, kwargs = task
+    try:
+        return True, func(item, **kwargs)
+    except Exception as e:
+        return False, (repr(e), traceback.format_exc())
+
+def map_items(func, items, processes=None, chunksize=1, **kwargs):
+    '''
+    Call func(item, **kwargs) for every item, in worker processes unless
+    processes is 1. func must be a module level function so it can be
+    sent to the workers, as are the items.
+    
+    Args:
+        processes (int): Number of worker processes, None uses every core.
+        chunksize (int): Number of items sent to a worker at once.
+    Return:
+        A generator of (succeeded, value) in the order of <items>. value
+        is the result, or the error and traceback if func raised.
+    '''
+    tasks = ((func, item, kwargs) for item in items)
+    if processes == 1:
+        for result in map(_call, tasks):
+            yield result
+    else:
+        with Pool(processes) as pool:
+            for result in pool.imap(_call, tasks, chunksize):
+                yield result
+
+def run_subjects(exp, func, processes=None, chunksize=1, **kwargs):
+    '''
+    Apply a per subject function, e.g. overtake_rates, to every subject of
+    an Experiment in parallel.
+    
+    Args:
+        exp: An instance of the Experiment class.
+        func: Function of a Subject and kwargs.
+        processes, chunksize: See map_items.
+    Return:
+        results (OrderedDict): Subject id to result, ordered by subject id,
+        without the subjects that failed.
+        failures (list): Instances of Failure.
+    '''
+    ids = sorted(exp.subjects)
+    results, failures = OrderedDict(), []
+    items = (exp.subjects[i] for i in ids)
+    for i, (ok, value) in zip(ids, map_items(func, items, processes, chunksize, **kwargs)):
+        if ok:
+            results[i] = value
+        else:
+            failures.append(Failure(i, None, *value))
+    return results, failures
+
+def run_trials(trials, func, processes=None, chunksize=8, freewalk=False, **kwargs):
+    '''
+    Apply a per trial function, e.g. lateral_overtake, to many trials in
+    parallel.
+    
+    Args:
+        trials: An instance of the Experiment class or a list of instances
+            of the Trial class.
+        func: Function of a Trial and kwargs.
+        processes, chunksize: See map_items.
+        freewalk (boolean): With an Experiment, whether include freewalk trials.
+    Return:
+        results (list): The result of every trial in the order of
+        Experiment.get_trials (or of the list), None for failed trials.
+        failures (list): Instances of Failure.
+    '''
+    if isinstance(trials, Experiment):
+        trials = trials.get_trials(freewalk)
+    results, failures = [], []
+    for t, (ok, value) in zip(trials, map_items(func, trials, processes, chunksize, **kwargs)):
+        results.append(value if ok else None)
+        if not ok:
+            failures.append(Failure(t.subject_id, t.trial_id, *value))
+    return results, failures
+
+def _analyze(subject, analyses):
+    # one task per subject so each subject is sent to a worker only once
+    report = {}
+    for name, (func, kwargs) in analyses.items():
+        try:
+            report[name] = (True, func(subject, **kwargs))
+        except Exception as e:
+            report[name] = (False, (repr(e), traceback.format_exc()))
+    return report
+
+def subject_report(exp, analyses=None, processes=None, chunksize=1):
+    '''
+    Run several per subject analyses over a whole Experiment using every
+    core by default.
+    
+    Args:
+        exp: An instance of the Experiment class.
+        analyses (OrderedDict): Name to (function, keyword arguments),
+            SUBJECT_ANALYSES if None.
+        processes, chunksize: See map_items.
+    Return:
+        report (OrderedDict): Analysis name to an OrderedDict from subject
+        id to result.
+        failures (dict): Analysis name to a list of instances of Failure.
+    '''
+    analyses = SUBJECT_ANALYSES if analyses is None else analyses
+    results, failures = run_subjects(exp, _analyze, processes, chunksize, analyses=analyses)
+    report = OrderedDict((name, OrderedDict()) for name in analyses)
+    errors = {name: [] for name in analyses}
+    for f in failures:
+        for name in analyses:
+            errors[name].append(f)
+    for i, outcomes in results.items():
+        for name, (ok, value) in outcomes.items():
+            if ok:
+                report[name][i] = value
+            else:
+                errors[name].append(Failure(i, None, *value))
+    return report, errors
@@ -0,0 +1,177 @@
+'''spatial index of the follower positions of many trials
+
+Every filtered follower position, in the rotated walking frame, is a point
+of two KD-trees: the 'absolute' one over its x-y position and the
+'relative' one over its position minus the leader's, from the leader
+onset on. Each point refers back to its trial and frame. Trials added
+later go into a new block with its own trees, so adding never recomputes
+the positions of the trials already indexed; blocks are merged when there
+are more than <max_blocks>.
+'''
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from Tomato3_dataStructure import Subject, Experiment
+from Tomato3_density import position_batches, leader_positions
+
+SPACES = ['absolute', 'relative']
+
+class _Block:
+    '''
+        Points of a group of trials and their trees.
+        attributes:
+            points (dict): Space to x-y positions with size (points, 2).
+            refs (dict): Space to (trial, frame) of each point with size
+                 (points, 2), trial is the position in SpatialIndex.trials.
+            trees (dict): Space to the cKDTree of the points.
+    '''
+    def __init__(self, points, refs):
+        self.points = points
+        self.refs = refs
+        self.trees = dict((space, cKDTree(points[space])) for space in SPACES)
+
+    @classmethod
+    def merge(cls, blocks):
+        return cls(dict((s, np.concatenate([b.points[s] for b in blocks])) for s in SPACES),
+                   dict((s, np.concatenate([b.refs[s] for b in blocks])) for s in SPACES))
+
+class SpatialIndex:
+    '''
+        Radius and box queries over the follower positions of many trials.
+        attributes:
+            trials (list): The indexed instances of the Trial class.
+            kwargs (dict): order, cutoff, backend used to filter positions.
+            max_blocks (int): Number of blocks above which they are merged.
+    '''
+    def __init__(self, trials=None, max_blocks=8, chunk=500, **kwargs):
+        '''
+        args:
+            trials: An instance of the Experiment or Subject class, whose
+                experimental trials are indexed, or a list of instances of
+                the Trial class.
+            max_blocks (int): See the attributes.
+            chunk (int): Number of trials filtered at once.
+            kwargs: order, cutoff, backend as in Trial.get_positions.
+        '''
+        self.trials = []
+        self.kwargs = kwargs
+        self.max_blocks = max_blocks
+        self.chunk = chunk
+        self._blocks = []
+        if trials is not None:
+            self.add(trials)
+
+    def __len__(self):
+        '''
+        return the number of indexed absolute positions.
+        '''
+        return sum(len(b.points['absolute']) for b in self._blocks)
+
+    def add(self, trials):
+        '''
+        Index more trials, see __init__. Only their positions are computed.
+        '''
+        if isinstance(trials, Experiment):
+            trials = trials.get_trials()
+        elif isinstance(trials, Subject):
+            trials = [trials.trials[j] for j in sorted(trials.trials)]
+        if not trials:
+            return
+        first = len(self.trials)
+        points = dict((s, []) for s in SPACES)
+        refs = dict((s, []) for s in SPACES)
+        for index, pos, _, lengths in position_batches(trials, self.chunk, **self.kwargs):
+            group = [trials[i] for i in index]
+            frames = np.arange(pos.shape[1])
+            number = np.broadcast_to(first + np.array(index)[:, None], pos.shape[:2])
+            frame = np.broadcast_to(frames, pos.shape[:2])
+            mask = frames < lengths[:, None]
+            points['absolute'].append(pos[mask])
+            refs['absolute'].append(np.stack((number[mask], frame[mask]), axis=1))
+            # only frames with a leader have a relative position
+            has_leader = np.array([t.leader is not None for t in group])
+            if has_leader.any():
+                leaders = [t for t in group if t.leader is not None]
+                relative = pos[has_leader] - leader_positions(leaders, frames)
+                mask = mask[has_leader] & (frames >= np.array([t.f1 for t in leaders])[:, None])
+                points['relative'].append(relative[mask])
+                refs['relative'].append(np.stack((number[has_leader][mask], frame[has_leader][mask]), axis=1))
+        for s in SPACES:
+            points[s] = np.concatenate(points[s]) if points[s] else np.empty((0, 2))
+            refs[s] = np.concatenate(refs[s]) if refs[s] else np.empty((0, 2), dtype=int)
+        self.trials += list(trials)
+        self._blocks.append(_Block(points, refs))
+        if len(self._blocks) > self.max_blocks:
+            self.rebuild()
+
+    def rebuild(self):
+        '''
+        Merge all blocks into one, so queries search a single tree per space.
+        '''
+        if len(self._blocks) > 1:
+            self._blocks = [_Block.merge(self._blocks)]
+
+    def _hits(self, refs):
+        '''
+        return a DataFrame of (trial, frame) pairs sorted by trial and frame.
+        '''
+        refs = np.concatenate(refs) if refs else np.empty((0, 2), dtype=int)
+        refs = refs[np.lexsort((refs[:, 1], refs[:, 0]))]
+        subject_ids = np.array([t.subject_id for t in self.trials], dtype=int)
+        trial_ids = np.array([t.trial_id for t in self.trials], dtype=int)
+        return pd.DataFrame(OrderedDict([('subject_id', subject_ids[refs[:, 0]]), ('trial_id', trial_ids[refs[:, 0]]),
+                                         ('trial', refs[:, 0]), ('frame', refs[:, 1])]))
+
+    def radius(self, center, r, space='relative'):
+        '''
+        return the frames whose position lies within <r> meters of <center>.
+
+        args:
+            center (tuple): x-y position in meters.
+            r (float): Radius in meters.
+            space (str): 'relative' (follower minus leader) or 'absolute'.
+        return:
+            A pandas DataFrame with columns subject_id, trial_id, trial
+            (position in self.trials) and frame, one row per frame, see
+            frame_sets.
+        '''
+        if space not in SPACES:
+            raise Exception('Unknown space ' + space)
+        refs = [b.refs[space][b.trees[space].query_ball_point(center, r)] for b in self._blocks]
+        return self._hits(refs)
+
+    def box(self, x, y, space='relative'):
+        '''
+        return the frames whose position lies in a box, e.g. within 0.5 m
+        laterally and up to 1 m behind the leader: box((-0.5, 0.5), (-1, 0)).
+
+        args:
+            x (tuple): Minimum and maximum x in meters.
+            y (tuple): Minimum and maximum y in meters.
+            space (str): See radius.
+        return:
+            See radius.
+        '''
+        if space not in SPACES:
+            raise Exception('Unknown space ' + space)
+        lower, upper = np.array([x[0], y[0]], dtype=float), np.array([x[1], y[1]], dtype=float)
+        center, half = (lower + upper) / 2, (upper - lower) / 2
+        refs = []
+        for b in self._blocks:
+            # the circle around the box, then the points inside it
+            i = np.array(b.trees[space].query_ball_point(center, np.hypot(*half)), dtype=int)
+            p = b.points[space][i]
+            inside = ((p >= lower) & (p <= upper)).all(axis=1)
+            refs.append(b.refs[space][i[inside]])
+        return self._hits(refs)
+
+def frame_sets(hits):
+    '''
+    return an OrderedDict from (subject_id, trial_id) to the array of
+    frames of a query result.
+    '''
+    sets = OrderedDict()
+    for key, rows in hits.groupby(['subject_id', 'trial_id'], sort=True):
+        sets[key] = rows['frame'].values
+    return sets
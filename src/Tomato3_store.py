@@ -0,0 +1,162 @@
+'''directory store of an experiment with memory-mapped trial arrays
+
+Layout of a store directory:
+    trials.csv      trial table (see Tomato3_columnar.TRIAL_COLUMNS) with the
+                    segment and first frame of every trial
+    subjects.csv    subject table
+    segments/<k>/   one <channel>.npy file per channel holding the frames
+                    of all trials of segment k back to back
+'''
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from Tomato3_dataStructure import LazyTrial, MemoryBudget
+from Tomato3_columnar import CHANNELS, ColumnarExperiment, subject_table, trial_metadata, make_trial, \
+                             make_experiment, add_trial
+
+def _segment_dir(path, segment):
+    return os.path.join(path, 'segments', str(segment).zfill(3))
+
+def write_segment(path, segment, exp):
+    '''
+    Write the trials of an Experiment as a new segment of the store.
+
+    Return:
+        The trial table of the segment.
+    '''
+    columnar = ColumnarExperiment.from_experiment(exp)
+    directory = _segment_dir(path, segment)
+    os.makedirs(directory)
+    for name in CHANNELS:
+        np.save(os.path.join(directory, name + '.npy'), columnar.channels[name])
+    table = columnar.trials
+    table['segment'] = segment
+    table['offset'] = columnar.offsets[:-1]
+    return table
+
+def write_tables(path, trials, subjects):
+    # write to temporary files first so a crash never leaves half a table
+    for table, name in [(trials, 'trials.csv'), (subjects, 'subjects.csv')]:
+        table.to_csv(os.path.join(path, name + '.tmp'), index=False)
+        os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+
+def next_segment(path):
+    '''
+    return the id of a new segment of a store, one more than the largest
+    segment directory on disk. Segments of dropped trials are only removed
+    at the end of an update, so the trial table cannot tell which are free.
+    '''
+    names = [int(name) for name in os.listdir(os.path.join(path, 'segments'))]
+    return max(names) + 1 if names else 0
+
+def remove_unused_segments(path, segments):
+    '''
+    Delete the segment directories of a store not listed in <segments>.
+    '''
+    for name in os.listdir(os.path.join(path, 'segments')):
+        if int(name) not in set(int(k) for k in segments):
+            shutil.rmtree(os.path.join(path, 'segments', name))
+
+def compact_store(path):
+    '''
+    Rewrite a store as a single segment without the frames of dropped trials.
+    '''
+    subjects = read_tables(path)[1]
+    exp = load_experiment(path, mmap=False)
+    shutil.rmtree(os.path.join(path, 'segments'))
+    write_tables(path, write_segment(path, 0, exp), subjects)
+
+def save_experiment(exp, path):
+    '''
+    Save an Experiment as a store directory, replacing any existing store.
+
+    Args:
+        exp: An instance of the Experiment class.
+        path (str): Directory of the store.
+    '''
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    write_tables(path, write_segment(path, 0, exp), subject_table(exp))
+
+def read_tables(path):
+    '''
+    return the trial table and the subject table of a store.
+    '''
+    trials = pd.read_csv(os.path.join(path, 'trials.csv'))
+    subjects = pd.read_csv(os.path.join(path, 'subjects.csv'))
+    return trials, subjects
+
+def open_segments(path, segments, mmap=True):
+    '''
+    return a dictionary from segment to a dictionary from channel name to
+    its array. With mmap the arrays are memory-mapped read-only, so opening
+    costs no reading and only the pages of the frames used are read later.
+    '''
+    mode = 'r' if mmap else None
+    return {k: {name: np.load(os.path.join(_segment_dir(path, k), name + '.npy'), mmap_mode=mode)
+                for name in CHANNELS} for k in segments}
+
+class TrialLoader:
+    '''
+        Reads the frames of one trial from a segment of a store, the loader
+        of a LazyTrial. Only the pages holding the trial are read.
+    '''
+    def __init__(self, path, segment, offset, length, has_leader_model):
+        self.path = path
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.has_leader_model = has_leader_model
+
+    def __call__(self):
+        directory = _segment_dir(self.path, self.segment)
+        arrays = {}
+        for name in CHANNELS:
+            channel = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+            arrays[name] = np.array(channel[self.offset:self.offset + self.length])
+        if not self.has_leader_model:
+            arrays['leader_model'] = None
+        return arrays
+
+def make_lazy_trial(path, row, budget=None):
+    '''
+    return a LazyTrial for a row of the trial table of a store.
+    '''
+    row = trial_metadata(row)
+    loader = TrialLoader(os.path.abspath(path), row['segment'], row['offset'], row['length'], row['has_leader_model'])
+    return LazyTrial(row['subject_id'], row['trial_id'], row['v0'], row['leader'], row['leader_onset'],
+                     row['length'], row['f1'], loader, budget, d0=row['d0'], Hz=row['Hz'], order=row['order'],
+                     cutoff=row['cutoff'], backend=row['backend'])
+
+def load_experiment(path, mmap=True, lazy=False, budget=None):
+    '''
+    Load an Experiment from a store directory.
+
+    Args:
+        path (str): Directory of the store.
+        mmap (boolean): Whether memory-map the trial arrays instead of
+             reading them into memory.
+        lazy (boolean): Whether the trials are LazyTrial proxies that read
+             their arrays on first access, so only the trials used are read.
+        budget (int): With lazy, the maximum number of bytes of loaded
+               arrays and their cached derived data, None for no limit.
+    Return:
+        An instance of the Experiment class. The arrays of every Trial are
+        read-only views into the segment files, or copies for lazy trials.
+    '''
+    trials, subjects = read_tables(path)
+    exp = make_experiment(subjects)
+    if lazy:
+        budget = MemoryBudget(budget)
+        for _, row in trials.iterrows():
+            add_trial(exp, make_lazy_trial(path, row, budget), row['freewalk'])
+        return exp
+    segments = open_segments(path, trials['segment'].unique(), mmap)
+    for _, row in trials.iterrows():
+        channels = segments[row['segment']]
+        start, stop = row['offset'], row['offset'] + row['length']
+        t = make_trial(row, {name: channels[name][start:stop] for name in CHANNELS})
+        add_trial(exp, t, row['freewalk'])
+    return exp
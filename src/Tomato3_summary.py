@@ -0,0 +1,161 @@
+'''per trial summary table computed once and kept in the store'''
+import os
+import numpy as np
+import pandas as pd
+from Tomato3_dataStructure import Experiment
+from Tomato3_columnar import select_rows
+from Tomato3_batch import classify_trials, trial_onsets, valid_trials, lateral_overtakes
+from Tomato3_store import read_tables, load_experiment
+
+V0S = [0.8, 0.9, 1.0, 1.1, 1.2, 1.3]
+
+# parameters the summary depends on, stored as columns of the table
+PARAMETERS = ['order', 'cutoff', 'backend', 'window', 'lateral_threshold', 'angle_threshold',
+              'valid_threshold', 'tolerance']
+DEFAULTS = {'window': 1, 'lateral_threshold': 0.3, 'angle_threshold': 55, 'valid_threshold': 0.2,
+            'tolerance': 0.02}
+
+# columns identifying a trial and the frames it was computed from
+KEYS = ['subject_id', 'trial_id', 'freewalk', 'segment', 'offset']
+
+def summarize(trials, window=1, lateral_threshold=0.3, angle_threshold=55, valid_threshold=0.2, tolerance=0.02,
+              **kwargs):
+    '''
+    Compute the per trial facts the analyses keep asking for.
+    
+    Args:
+        trials: An instance of the Experiment class, whose experimental
+            trials are used, or a list of instances of the Trial class.
+        window, lateral_threshold, angle_threshold, valid_threshold: See
+            Tomato3_batch.classify_trials.
+        tolerance (float): See Tomato3_helper.overtake_onset.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
+    Return:
+        The table of classify_trials with the column 'onset', the frame
+        of overtake_onset, and the columns of PARAMETERS.
+    '''
+    if isinstance(trials, Experiment):
+        trials = trials.get_trials()
+    table = classify_trials(trials, lateral_threshold, angle_threshold, valid_threshold, window, **kwargs)
+    table['onset'] = trial_onsets(trials, tolerance, **kwargs)
+    for key in ['order', 'cutoff', 'backend']:
+        if key in kwargs:
+            table[key] = kwargs[key]
+    table['window'] = window
+    table['lateral_threshold'] = lateral_threshold
+    table['angle_threshold'] = angle_threshold
+    table['valid_threshold'] = valid_threshold
+    table['tolerance'] = tolerance
+    return table
+
+def _experimental(trials):
+    '''
+    return the experimental rows of a trial table in the order of
+    Experiment.get_trials, by subject and trial id. Incremental updates
+    append rows at the end of the table, so its own order differs.
+    '''
+    trials = trials[~trials['freewalk'].astype(bool)]
+    return trials.sort_values(['subject_id', 'trial_id']).reset_index(drop=True)
+
+def _is_current(summary, trials, parameters):
+    '''
+    Whether a stored summary was computed from the experimental trials of
+    the trial table of the store, with the given parameters.
+    '''
+    trials = _experimental(trials)
+    if len(summary) != len(trials):
+        return False
+    if not (summary[KEYS].values == trials[KEYS].values).all():
+        return False
+    for key, value in parameters.items():
+        column = trials[key] if key in ['order', 'cutoff', 'backend'] and value is None else value
+        if not (summary[key].values == np.asarray(column)).all():
+            return False
+    return True
+
+def trial_summary(path, recompute=False, **parameters):
+    '''
+    return the summary table of a store (see Tomato3_store), computing
+    and saving it as summary.csv in the store when it is missing, was
+    computed with other parameters or the trials changed since.
+    
+    Args:
+        path (str): Directory of the store.
+        recompute (boolean): Whether recompute even if the saved one is current.
+        parameters: Any of PARAMETERS, see summarize. order, cutoff and
+            backend default to the ones of each trial.
+    '''
+    for key in parameters:
+        if key not in PARAMETERS:
+            raise Exception('Unknown summary parameter ' + key)
+    parameters = dict(DEFAULTS, **parameters)
+    for key in ['order', 'cutoff', 'backend']:
+        parameters.setdefault(key, None)
+    trials = read_tables(path)[0]
+    summary_path = os.path.join(path, 'summary.csv')
+    if not recompute and os.path.isfile(summary_path):
+        summary = pd.read_csv(summary_path)
+        if _is_current(summary, trials, parameters):
+            return summary
+    exp = load_experiment(path, lazy=True)
+    kwargs = {k: v for k, v in parameters.items() if v is not None}
+    summary = summarize(exp, **kwargs)
+    summary = summary.merge(_experimental(trials)[['subject_id', 'trial_id', 'segment', 'offset']],
+                            on=['subject_id', 'trial_id'], how='left')
+    summary.to_csv(summary_path + '.tmp', index=False)
+    os.replace(summary_path + '.tmp', summary_path)
+    return summary
+
+def query(summary, **criteria):
+    '''
+    return the rows of a summary matching all criteria, e.g.
+    query(summary, subject_id=3, v0=[1.2, 1.3], leader='pole').
+    '''
+    return summary.iloc[select_rows(summary, **criteria)]
+
+def overtake_rates(summary, subject_id, threshold=0.2, valid_threshold=0.2):
+    '''
+    Table lookup version of Tomato3_helper.overtake_rates. Like the helper,
+    overtakes are labeled with a lateral threshold of 0.2 m by default, not
+    with the 0.3 m of the summary's 'lateral' column, so both are computed
+    again from the statistics columns. The result equals the helper's for
+    a summary built with window=1. A v0 without valid trials has rate nan.
+    
+    Args:
+        summary (pandas DataFrame): See trial_summary.
+        subject_id (int)
+        threshold (float): Lateral threshold in meters, see
+            Tomato3_helper.lateral_overtake.
+        valid_threshold (float): See Tomato3_helper.valid_trial.
+    '''
+    s = query(summary, subject_id=subject_id)
+    valid = valid_trials(s, valid_threshold)
+    lateral = lateral_overtakes(s, threshold, valid_threshold)
+    rates = {}
+    for v0 in V0S:
+        rows = (s['v0'] == v0).values
+        n = float(valid[rows].sum())
+        rates[v0] = lateral[rows].sum() / n if n else np.nan
+    return rates
+
+def average_onset_delays(summary, subject_id):
+    '''
+    Table lookup version of Tomato3_helper.average_onset_delays.
+    '''
+    s = query(summary, subject_id=subject_id)
+    overtakes = s[s['valid'] & s['lateral']]
+    delays = {}
+    for v0 in V0S:
+        rows = overtakes[overtakes['v0'] == v0]
+        if len(rows) == 0:
+            delays[v0] = delays[round(v0 - 0.1, 1)]
+        else:
+            delays[v0] = int((rows['onset'] - rows['f1']).sum() / float(len(rows)))
+    return delays
+
+def average_onset_spds(summary, subject_id):
+    '''
+    Table lookup version of Tomato3_helper.average_onset_spds.
+    '''
+    s = query(summary, subject_id=subject_id)
+    return [(s.loc[s['v0'] == v0, 'spd_f1'] / 10).sum() for v0 in V0S]
@@ -0,0 +1,127 @@
+'''sensitivity of the overtaking criteria to their thresholds'''
+import numpy as np
+import pandas as pd
+import helper
+from Tomato3_dataStructure import Experiment
+from Tomato3_batch import filter_groups, valid_trials
+from Tomato3_summary import V0S
+
+# The threshold independent statistics come from
+# Tomato3_batch.overtake_statistics (or a summary of Tomato3_summary),
+# computed once. Every sweep below broadcasts the thresholds against them
+# and returns a boolean array with one row per trial and one column per
+# threshold.
+
+def lateral_sweep(stats, thresholds, valid_threshold=0.2):
+    '''
+    return whether each trial is a lateral overtake (see
+    Tomato3_helper.lateral_overtake) for every threshold in meters.
+    '''
+    thresholds = np.asarray(thresholds, dtype=float)
+    fwd_vel_max = np.maximum(stats['fwd_vel_max'].values, 0)
+    faster = valid_trials(stats, valid_threshold) & (fwd_vel_max > stats['v0'].values)
+    return faster[:, None] & (stats['lat_max'].values[:, None] > thresholds)
+
+def angle_sweep(stats, angles):
+    '''
+    return whether each trial is an angle overtake (see
+    Tomato3_helper.angle_overtake) for every angle in degrees.
+    '''
+    angles = np.asarray(angles, dtype=float)
+    return stats['cos_angle'].values[:, None] < np.cos(angles * np.pi / 180)
+
+def rate_curves(stats, hits, thresholds, valid_threshold=0.2):
+    '''
+    Overtake rates among valid trials, as in Tomato3_helper.overtake_rates,
+    for every threshold of a sweep.
+    
+    Args:
+        stats (pandas DataFrame): Statistics of the trials.
+        hits (2-d np array of boolean): Result of a sweep over <stats>.
+        thresholds (list): The thresholds of the sweep.
+    Return:
+        A pandas DataFrame indexed by threshold with one column of rates
+        per v0, nan for a v0 without valid trials.
+    '''
+    valid = valid_trials(stats, valid_threshold)
+    v0 = stats['v0'].values
+    curves = {}
+    for key in V0S:
+        rows = valid & (v0 == key)
+        n = float(rows.sum())
+        curves[key] = hits[rows].sum(axis=0) / n if n else np.full(len(thresholds), np.nan)
+    return pd.DataFrame(curves, index=pd.Index(thresholds, name='threshold'), columns=V0S)
+
+def agreement(stats, thresholds, angles, valid_threshold=0.2):
+    '''
+    The fraction of valid trials on which the lateral criterion and the
+    angle criterion agree, for every pair of lateral threshold and angle.
+    
+    Return:
+        A pandas DataFrame indexed by lateral threshold with one column
+        per angle.
+    '''
+    valid = valid_trials(stats, valid_threshold)
+    lateral = lateral_sweep(stats, thresholds, valid_threshold)[valid].astype(float)
+    angle = angle_sweep(stats, angles)[valid].astype(float)
+    # trials both criteria call overtakes plus trials neither does
+    agree = np.dot(lateral.T, angle) + np.dot(1 - lateral.T, 1 - angle)
+    return pd.DataFrame(agree / max(valid.sum(), 1), index=pd.Index(thresholds, name='threshold'),
+                        columns=pd.Index(angles, name='angle'))
+
+def onset_intervals(trials, **kwargs):
+    '''
+    The tolerance independent part of Tomato3_helper.overtake_onset.
+    find_intersections reports a crossing between frames i and i + 1 when
+    the distance between the curves is below the tolerance at exactly one
+    of them, that is for tolerances in (lo, hi] where lo and hi are the
+    smaller and larger of the two distances.
+    
+    Args:
+        trials: An instance of the Experiment class, whose experimental
+            trials are used, or a list of instances of the Trial class.
+        kwargs: order, cutoff, backend as in Trial.get_positions.
+    Return:
+        A list with for each trial (f1, zero_lo, zero_hi, average_lo,
+        average_hi), the crossing intervals of the lateral velocity with
+        zero and with its running average before the lateral speed peak.
+    '''
+    if isinstance(trials, Experiment):
+        trials = trials.get_trials()
+    intervals = [None] * len(trials)
+    for index, data, lengths in filter_groups(trials, **kwargs):
+        vel = helper.gradient_batch(data[:, :, 0], lengths, trials[index[0]].Hz)
+        for j, i in enumerate(index):
+            t = trials[i]
+            fpos_x, fvel_x = data[j, :lengths[j], 0], vel[j, :lengths[j]]
+            average_x = helper.running_average(fvel_x)
+            pos_peak = min(np.argmax(abs(fpos_x)), t.length - t.Hz)
+            if pos_peak == 0:
+                pos_peak = 1
+            ipeak = np.argmax(abs(fvel_x[:pos_peak]))
+            zero = abs(fvel_x[:ipeak])
+            average = abs(fvel_x[:ipeak] - average_x[:ipeak])
+            intervals[i] = (t.f1, np.minimum(zero[:-1], zero[1:]), np.maximum(zero[:-1], zero[1:]),
+                            np.minimum(average[:-1], average[1:]), np.maximum(average[:-1], average[1:]))
+    return intervals
+
+def _last_crossing(lo, hi, tolerances):
+    # last frame whose interval contains each tolerance, 0 if none does
+    cross = (lo[:, None] < tolerances) & (tolerances <= hi[:, None])
+    if len(lo) == 0:
+        return np.zeros(len(tolerances), dtype=int)
+    last = len(lo) - 1 - np.argmax(cross[::-1], axis=0)
+    return np.where(cross.any(axis=0), last, 0)
+
+def onset_sweep(intervals, tolerances):
+    '''
+    return a 2-d np array of int, the overtake onset frame of each trial
+    of onset_intervals for every tolerance, identical to overtake_onset.
+    '''
+    tolerances = np.asarray(tolerances, dtype=float)
+    onsets = np.empty((len(intervals), len(tolerances)), dtype=int)
+    for i, (f1, zero_lo, zero_hi, average_lo, average_hi) in enumerate(intervals):
+        z = _last_crossing(zero_lo, zero_hi, tolerances)
+        a = _last_crossing(average_lo, average_hi, tolerances)
+        onsets[i] = np.maximum(f1, np.maximum(a, z))
+    return onsets
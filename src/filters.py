@@ -0,0 +1,165 @@
+'''zero-phase low pass filters with selectable backends'''
+import timeit
+from functools import lru_cache
+import numpy as np
+from scipy.fft import next_fast_len
+from scipy.signal import butter, lfilter, lfilter_zi, sosfilt, sosfilt_zi, sosfreqz
+
+@lru_cache(maxsize=None)
+def design(order, cutoff, Hz, output='ba'):
+    '''
+    Design a Butterworth low pass filter. The coefficients are cached,
+    so repeated calls with the same parameters cost a dictionary lookup.
+
+    Args:
+        order (int): Order of the filter.
+        cutoff (float): Cutoff frequency in Hz.
+        Hz (float): Sampling rate.
+        output (str): 'ba' for transfer function coefficients, 'sos' for
+        second-order sections.
+    Return:
+        (b, a) or sos. The arrays are shared, do not modify them.
+    '''
+    return butter(order, cutoff / (Hz / 2.0), output=output)
+
+@lru_cache(maxsize=64)
+def _power_gain(order, cutoff, Hz, n):
+    '''
+    Squared magnitude response of the filter at the rfft frequencies of
+    a series with n samples, i.e. the response of a forward and backward pass.
+    '''
+    freqs = np.fft.rfftfreq(n, 1.0 / Hz)
+    _, h = sosfreqz(design(order, cutoff, Hz, 'sos'), worN=freqs, fs=Hz)
+    gain = np.abs(h) ** 2
+    gain.flags.writeable = False
+    return gain
+
+def _reverse(data, lengths):
+    '''
+    Reverse each row of a padded batch within its own length along axis 1.
+    Elements beyond a row's length are undefined.
+    '''
+    idx = np.maximum(lengths[:, None] - 1 - np.arange(data.shape[1]), 0)
+    idx = idx.reshape(idx.shape + (1,) * (data.ndim - 2))
+    return np.take_along_axis(data, idx, axis=1)
+
+def _filtfilt(data, lengths, order, cutoff, Hz):
+    b, a = design(order, cutoff, Hz, 'ba')
+    zi = lfilter_zi(b, a).reshape((1, -1) + (1,) * (data.ndim - 2))
+    y, _ = lfilter(b, a, data, axis=1, zi=zi * data[:, :1])
+    y = _reverse(y, lengths)
+    y, _ = lfilter(b, a, y, axis=1, zi=zi * y[:, :1])
+    return _reverse(y, lengths)
+
+def _sosfiltfilt(data, lengths, order, cutoff, Hz):
+    sos = design(order, cutoff, Hz, 'sos')
+    # zi has size (sections, rows, 2, ...), one state per row and channel
+    zi = sosfilt_zi(sos).reshape((len(sos), 1, 2) + (1,) * (data.ndim - 2))
+    y, _ = sosfilt(sos, data, axis=1, zi=zi * data[None, :, :1])
+    y = _reverse(y, lengths)
+    y, _ = sosfilt(sos, y, axis=1, zi=zi * y[None, :, :1])
+    return _reverse(y, lengths)
+
+def _fft_rows(data, lengths, order, cutoff, Hz):
+    n = data.shape[1]
+    t = np.arange(n).reshape((1, -1) + (1,) * (data.ndim - 2))
+    last = (lengths - 1).reshape((-1, 1) + (1,) * (data.ndim - 2))
+    x0 = data[:, :1]
+    x1 = np.take_along_axis(data, np.broadcast_to(last, x0.shape), axis=1)
+    # hold the last value after the end of each row, then remove the line
+    # through both ends so the series is continuous when wrapped around
+    data = np.where(t <= last, data, x1)
+    trend = x0 + (x1 - x0) * np.minimum(t, last) / np.maximum(last, 1)
+    spectrum = np.fft.rfft(data - trend, axis=1)
+    spectrum *= _power_gain(order, cutoff, Hz, n).reshape((1, -1) + (1,) * (data.ndim - 2))
+    return np.fft.irfft(spectrum, n, axis=1) + trend
+
+def _fft(data, lengths, order, cutoff, Hz):
+    # the transform length of a row only depends on its own length, so a
+    # row is filtered the same whatever the other rows of the batch
+    sizes = np.array([next_fast_len(int(length)) for length in lengths], dtype=int)
+    result = np.empty_like(data)
+    for n in np.unique(sizes):
+        rows = np.flatnonzero(sizes == n)
+        m = min(n, data.shape[1])
+        part = np.zeros((len(rows), n) + data.shape[2:])
+        part[:, :m] = data[rows, :m]
+        result[rows, :m] = _fft_rows(part, lengths[rows], order, cutoff, Hz)[:, :m]
+    return result
+
+BACKENDS = {'filtfilt': _filtfilt, 'sosfiltfilt': _sosfiltfilt, 'fft': _fft}
+
+# maximum absolute deviation from the filtfilt backend, in the unit of
+# the data, accepted by check_backends. The fft backend treats the ends
+# of a series differently, so it only agrees away from the boundaries.
+TOLERANCES = {'filtfilt': 0.0, 'sosfiltfilt': 1e-6, 'fft': 2e-2}
+
+def zero_phase(data, order, cutoff, Hz, backend='filtfilt'):
+    '''
+    Filter the data forward and backward along axis 0 without padding,
+    like filtfilt(b, a, data, axis=0, padtype=None).
+
+    Args:
+        data (np array of float): With size (steps, ...).
+        order, cutoff, Hz: Parameters of the Butterworth filter.
+        backend (str): 'filtfilt', 'sosfiltfilt' or 'fft'.
+    Return:
+        Filtered data with the same size.
+    '''
+    data = np.asarray(data, dtype=float)
+    return BACKENDS[backend](data[None], np.array([len(data)]), order, cutoff, Hz)[0]
+
+def zero_phase_batch(data, lengths, order, cutoff, Hz, backend='filtfilt'):
+    '''
+    Filter every row of a padded batch along axis 1, each row from its
+    own first to its own last element, in one vectorized call.
+
+    Args:
+        data (np array of float): With size (rows, steps, ...).
+        lengths (1-d np array of int): Length of each row.
+        order, cutoff, Hz: Parameters of the Butterworth filter.
+        backend (str): 'filtfilt', 'sosfiltfilt' or 'fft'.
+    Return:
+        Filtered data with the same size. Elements beyond the length
+        of a row are undefined.
+    '''
+    return BACKENDS[backend](np.asarray(data, dtype=float), np.asarray(lengths), order, cutoff, Hz)
+
+def check_backends(data, lengths, order=4, cutoff=0.6, Hz=90, margin=None):
+    '''
+    Compare every backend with the filtfilt backend on a padded batch.
+    <margin> samples at both ends of each row are not compared, by default
+    the 3 seconds of pads Trial.filter_data removes after filtering.
+
+    Return:
+        A dictionary. Keys are backends, values are the maximum absolute
+        deviations from filtfilt.
+    Raise:
+        Exception if a backend deviates more than its tolerance.
+    '''
+    margin = int(3 * Hz) if margin is None else margin
+    data = np.asarray(data, dtype=float)
+    t = np.arange(data.shape[1])
+    mask = (t >= margin) & (t < np.asarray(lengths)[:, None] - margin)
+    reference = zero_phase_batch(data, lengths, order, cutoff, Hz)[mask]
+    errors = {}
+    for backend in BACKENDS:
+        result = zero_phase_batch(data, lengths, order, cutoff, Hz, backend)[mask]
+        errors[backend] = np.abs(result - reference).max()
+        if errors[backend] > TOLERANCES[backend]:
+            raise Exception(backend + ' deviates ' + str(errors[backend]) + ' from filtfilt')
+    return errors
+
+def benchmark_backends(data, lengths, order=4, cutoff=0.6, Hz=90, repeat=5):
+    '''
+    Time every backend on a padded batch.
+
+    Return:
+        A dictionary. Keys are backends, values are the best time of
+        <repeat> runs in seconds.
+    '''
+    times = {}
+    for backend in BACKENDS:
+        run = lambda: zero_phase_batch(data, lengths, order, cutoff, Hz, backend)
+        times[backend] = min(timeit.repeat(run, number=1, repeat=repeat))
+    return times
@@ -1,4 +1,5 @@
 import numpy as np
+import sliding
 
 def max_average(data, window):
     '''
@@ -11,13 +12,7 @@ def max_average(data, window):
     '''
     if window > len(data): 
         raise Exception('Window length is bigger than array')
-    window = int(window)
-    max_mean = 0
-    for i in range(len(data) - window + 1):
-        mean = sum(data[i:i + window]) * 1.0 / window
-        if mean > max_mean:
-            max_mean = mean
-    return max_mean
+    return max(0, sliding.max_average(data, window))
    
 def find_intersections(x1, x2, tolerance):
     '''
@@ -56,6 +51,48 @@ def expansions(lpos, fpos, lvel, fvel, relative, w):
         e /= 2 * np.arctan(w / (2 * dist))
     return e
 
+def gradient(data, Hz, out=None):
+    '''
+    Time derivative of a uniformly sampled series along axis 0, identical
+    to np.gradient(data, axis=0) * Hz but written into <out> so the result
+    can live in a preallocated buffer.
+    
+    Args:
+        data (np array of float): With size (steps, ...), at least 2 steps.
+        Hz (float): Sampling rate.
+        out (np array of float): Array with the same shape as data.
+    Return:
+        out
+    '''
+    if out is None:
+        out = np.empty(data.shape)
+    np.subtract(data[2:], data[:-2], out=out[1:-1])
+    out[1:-1] /= 2.0
+    np.subtract(data[1], data[0], out=out[0])
+    np.subtract(data[-1], data[-2], out=out[-1])
+    out *= Hz
+    return out
+
+def gradient_batch(data, lengths, Hz):
+    '''
+    Time derivative of many series padded to a common length, along axis 1.
+    Row i is identical to gradient(data[i, :lengths[i]], Hz), elements
+    after the end of a row are undefined.
+    
+    Args:
+        data (np array of float): With size (series, steps, ...).
+        lengths (1-d np array of int): Length of each series, at least 2.
+        Hz (float): Sampling rate.
+    '''
+    out = np.empty(data.shape)
+    np.subtract(data[:, 2:], data[:, :-2], out=out[:, 1:-1])
+    out[:, 1:-1] /= 2.0
+    np.subtract(data[:, 1], data[:, 0], out=out[:, 0])
+    rows = np.arange(len(data))
+    out[rows, lengths - 1] = data[rows, lengths - 1] - data[rows, lengths - 2]
+    out *= Hz
+    return out
+
 def running_average(data):
     '''
     Args:
@@ -0,0 +1,89 @@
+'''resample irregularly time stamped series onto a uniform timebase'''
+import numpy as np
+
+def timebase(length, Hz, pad=0):
+    '''
+    return the uniform time axis of a series with <length> frames sampled
+    at <Hz>, extended by <pad> seconds on both sides. Frame i of the
+    series is at i / Hz seconds.
+    '''
+    return np.arange(-int(pad*Hz), length + int(pad*Hz)) * 1.0 / Hz
+
+def _interpolate(tstamps, data, t, hi):
+    '''
+    Linear interpolation at times t between the samples hi - 1 and hi of
+    the concatenated series, extrapolating when t is outside them.
+    Identical to scipy's interp1d(kind='linear', fill_value='extrapolate').
+    '''
+    lo = hi - 1
+    x_lo, x_hi = tstamps[lo], tstamps[hi]
+    y_lo, y_hi = data[lo], data[hi]
+    shape = (-1,) + (1,) * (data.ndim - 1)
+    slope = (y_hi - y_lo) / (x_hi - x_lo).reshape(shape)
+    return slope * (t - x_lo).reshape(shape) + y_lo
+
+def resample_batch(tstamps, data, Hz, pad=0, mode='linear'):
+    '''
+    Resample many series onto the uniform timebase(len(series), Hz, pad)
+    of each series in one vectorized pass, with the value at time t
+    interpolated between the two time stamps around t.
+
+    Args:
+        tstamps (list of 1-d np array): Increasing time stamps in seconds
+        of each series.
+        data (list of np array): Series with size (frames, ...).
+        Hz (float): Rate of the uniform timebase.
+        pad (float): Seconds added before the first and after the last frame.
+        mode (str): How the pads are filled. 'linear' extrapolates the
+        first and last interval, 'reflect' mirrors the series about its
+        end points (odd reflection), which keeps the local trend without
+        amplifying the noise of a single interval.
+    Return:
+        out (np array): With size (series, longest timebase, ...), padded
+        with zeros after the end of each timebase.
+        lengths (1-d np array of int): Length of each timebase.
+    '''
+    n = len(data)
+    npad = int(pad*Hz)
+    frames = np.array([len(x) for x in data], dtype=int)
+    lengths = frames + 2*npad
+    first = np.concatenate(([0], np.cumsum(frames)[:-1]))
+    last = first + frames - 1
+    stamps = np.concatenate(tstamps).astype(float)
+    values = np.concatenate(data).astype(float)
+    # sample times of the padded output, one row per series
+    t = (np.arange(lengths.max()) - npad) * 1.0 / Hz
+    mask = np.arange(lengths.max()) < lengths[:, None]
+    row = np.broadcast_to(np.arange(n)[:, None], mask.shape)[mask]
+    t = np.broadcast_to(t, mask.shape)[mask]
+    first, last = first[row], last[row]
+    start, end = stamps[first], stamps[last]
+    if mode == 'reflect':
+        before, after = t < start, t > end
+        # mirror the sample time about the end points, clamped to the series
+        t_ref = np.clip(np.where(before, 2*start - t, np.where(after, 2*end - t, t)), start, end)
+    elif mode == 'linear':
+        t_ref = t
+    else:
+        raise Exception('Unknown padding mode ' + str(mode))
+    # shift every series to its own time window, so a single searchsorted
+    # over the concatenated stamps never crosses series boundaries
+    lower = min(min(x[0] for x in tstamps), -pad)
+    upper = max(max(x[-1] for x in tstamps), frames.max() * 1.0 / Hz + pad)
+    shift = (upper - lower + 1.0) * np.arange(n)
+    hi = np.searchsorted(stamps + np.repeat(shift, frames), t_ref + shift[row])
+    out = _interpolate(stamps, values, t_ref, np.clip(hi, first + 1, last))
+    if mode == 'reflect':
+        shape = (-1,) + (1,) * (values.ndim - 1)
+        out = np.where(before.reshape(shape), 2*values[first] - out, out)
+        out = np.where(after.reshape(shape), 2*values[last] - out, out)
+    result = np.zeros(mask.shape + values.shape[1:])
+    result[mask] = out
+    return result, lengths
+
+def resample(tstamps, data, Hz, pad=0, mode='linear'):
+    '''
+    Resample one series onto timebase(len(data), Hz, pad).
+    See resample_batch for the arguments.
+    '''
+    return resample_batch([tstamps], [data], Hz, pad, mode)[0][0]
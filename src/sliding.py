@@ -0,0 +1,97 @@
+'''sliding window statistics in linear time'''
+import numpy as np
+
+def window_frames(window, Hz=None):
+    '''
+    return the window size in frames. <window> is in frames if Hz is None,
+    otherwise in seconds and may be fractional.
+    '''
+    frames = int(window) if Hz is None else int(round(window * Hz))
+    if frames < 1:
+        raise Exception('Window is shorter than one frame')
+    return frames
+
+def _valid(means, window, lengths):
+    '''
+    return a boolean array with the size of <means> marking the windows
+    that lie entirely within the length of their row.
+    '''
+    if lengths is None:
+        return np.ones(means.shape, dtype=bool)
+    return np.arange(means.shape[-1]) + window <= np.asarray(lengths)[..., None]
+
+def rolling_sum(data, window, Hz=None):
+    '''
+    Sum over every window along the last axis, computed from one
+    cumulative sum.
+
+    Args:
+        data (np array of float): 1-d series or 2-d batch with one series per row.
+        window: Window size in frames, or in seconds if Hz is given.
+        Hz (float): Sampling rate.
+    Return:
+        np array with size data.shape[:-1] + (n - window + 1,). Element i
+        is the sum of data[..., i:i + window].
+    '''
+    data = np.asarray(data, dtype=float)
+    window = window_frames(window, Hz)
+    if window > data.shape[-1]:
+        raise Exception('Window length is bigger than array')
+    c = np.zeros(data.shape[:-1] + (data.shape[-1] + 1,))
+    np.cumsum(data, axis=-1, out=c[..., 1:])
+    return c[..., window:] - c[..., :-window]
+
+def rolling_mean(data, window, Hz=None):
+    '''
+    Mean over every window along the last axis, see rolling_sum.
+    '''
+    return rolling_sum(data, window, Hz) / window_frames(window, Hz)
+
+def rolling_std(data, window, Hz=None):
+    '''
+    Standard deviation over every window along the last axis, see rolling_sum.
+    '''
+    data = np.asarray(data, dtype=float)
+    # center the data first so the sums of squares do not lose precision
+    data = data - data.mean(axis=-1, keepdims=True)
+    mean = rolling_mean(data, window, Hz)
+    var = rolling_mean(data ** 2, window, Hz) - mean ** 2
+    return np.sqrt(np.maximum(var, 0))
+
+def max_average(data, window, Hz=None, lengths=None):
+    '''
+    args:
+        data (np array of float): 1-d series or 2-d batch with one series
+        per row, padded after the end of shorter rows.
+        window: Number of frames, or seconds if Hz is given, over which
+        the average is computed.
+        Hz (float): Sampling rate.
+        lengths (1-d np array of int): Length of each row of a batch.
+        Windows reaching into the padding are ignored.
+    return:
+        The maximum averaged value over <window> size window, one per row
+        for a batch.
+    '''
+    means = rolling_mean(data, window, Hz)
+    return np.where(_valid(means, window_frames(window, Hz), lengths), means, -np.inf).max(axis=-1)
+
+def min_average(data, window, Hz=None, lengths=None):
+    '''
+    The minimum averaged value over <window> size window, see max_average.
+    '''
+    means = rolling_mean(data, window, Hz)
+    return np.where(_valid(means, window_frames(window, Hz), lengths), means, np.inf).min(axis=-1)
+
+def argmax_average(data, window, Hz=None, lengths=None):
+    '''
+    The first frame of the window with the maximum average, see max_average.
+    '''
+    means = rolling_mean(data, window, Hz)
+    return np.where(_valid(means, window_frames(window, Hz), lengths), means, -np.inf).argmax(axis=-1)
+
+def argmin_average(data, window, Hz=None, lengths=None):
+    '''
+    The first frame of the window with the minimum average, see max_average.
+    '''
+    means = rolling_mean(data, window, Hz)
+    return np.where(_valid(means, window_frames(window, Hz), lengths), means, np.inf).argmin(axis=-1)
@@ -0,0 +1,45 @@
+import os
+import sys
+import numpy as np
+from scipy.signal import butter, filtfilt
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+import filters
+import resample
+
+HZ = 90
+
+def make_batch(lengths=(700, 1000, 1333, 905), seed=0):
+    # walks at about 1.2 m/s with tracking noise, resampled with the 3 s
+    # of extrapolated pads of Trial.filter_data
+    rng = np.random.RandomState(seed)
+    tstamps, series = [], []
+    for n in lengths:
+        t = np.arange(n) / float(HZ) + rng.normal(0, 0.002, n)
+        pos = np.column_stack((0.2 * np.sin(t), 1.2 * t, np.full(n, 1.7))) + rng.normal(0, 0.01, (n, 3))
+        tstamps.append(np.sort(t))
+        series.append(pos)
+    return resample.resample_batch(tstamps, series, HZ, 3)
+
+def test_batch_equals_single():
+    data, lengths = make_batch()
+    for backend in filters.BACKENDS:
+        batch = filters.zero_phase_batch(data, lengths, 4, 0.6, HZ, backend)
+        for row, filtered, n in zip(data, batch, lengths):
+            single = filters.zero_phase(row[:n], 4, 0.6, HZ, backend)
+            assert np.allclose(filtered[:n], single, rtol=0, atol=1e-12), backend
+
+def test_backends_within_tolerances():
+    data, lengths = make_batch()
+    errors = filters.check_backends(data, lengths, 4, 0.6, HZ)
+    for backend in filters.BACKENDS:
+        assert errors[backend] <= filters.TOLERANCES[backend]
+
+def test_filtfilt_equals_scipy():
+    data, lengths = make_batch()
+    b, a = butter(4, 0.6 / (HZ / 2.0))
+    for row, n in zip(data, lengths):
+        expected = filtfilt(b, a, row[:n], axis=0, padtype=None)
+        assert np.array_equal(filters.zero_phase(row[:n], 4, 0.6, HZ), expected)
+    batch = filters.zero_phase_batch(data, lengths, 4, 0.6, HZ)
+    for row, filtered, n in zip(data, batch, lengths):
+        assert np.array_equal(filtered[:n], filtfilt(b, a, row[:n], axis=0, padtype=None))
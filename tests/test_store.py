@@ -0,0 +1,26 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+from Tomato3_importData import update_store
+from Tomato3_store import load_experiment
+from test_update_store import write_trial, make_dirs
+
+def test_budget_counts_cached_kinematics(tmp_path):
+    output_dir, input_dir, store = make_dirs(str(tmp_path))
+    for i in range(1, 4):
+        write_trial(output_dir, 1, i, seed=i)
+    update_store(output_dir, input_dir, store, processes=1)
+    trials = load_experiment(store, lazy=True).get_trials()
+    budget = trials[0].budget
+    raw = trials[0].fpos.nbytes
+    assert budget.used == trials[0].nbytes
+    trials[0].get_positions('f')
+    assert budget.used == trials[0].nbytes > raw
+    # room for two trials with their kinematics, caching in a third releases the oldest
+    budget.limit = 2 * trials[0].nbytes
+    for t in trials:
+        t.get_positions('f')
+    assert [t.loaded for t in trials] == [False, True, True]
+    assert budget.used == sum(t.nbytes for t in trials) <= budget.limit
+    trials[1].release()
+    assert budget.used == trials[2].nbytes
@@ -0,0 +1,69 @@
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+from Tomato3_dataStructure import Trial, Subject, Experiment
+import Tomato3_helper
+import Tomato3_summary
+from Tomato3_importData import update_store
+from Tomato3_store import read_tables
+from test_update_store import write_trial, make_dirs
+
+V0S = Tomato3_summary.V0S
+
+def make_trial(subject_id, trial_id, v0, lateral, rng):
+    Hz, n, f1 = 90, 1000, 300
+    tstamps = np.arange(n) / float(Hz) + rng.normal(0, 0.0005, n)
+    tstamps[0] = 0
+    # walk along the diagonal of the room, swerving by <lateral> meters
+    theta = np.arctan(9 / 11.0)
+    rotation = np.array([[np.cos(theta), np.sin(theta)], [-np.sin(theta), np.cos(theta)]])
+    s = 1.3 * np.arange(n) / float(Hz)
+    lat = lateral / 2 * (1 + np.tanh((np.arange(n) - 600) / 80.0))
+    fpos = np.zeros((n, 3))
+    fpos[:, :2] = np.stack((lat, s), 1).dot(rotation.T) + [-4.5, -5.5] + rng.normal(0, 0.003, (n, 2))
+    lpos = np.zeros((n, 3))
+    lxy = np.stack((np.zeros(n), 2 + s[f1] + v0 * (np.arange(n) - f1) / float(Hz)), 1).dot(rotation.T) + [-4.5, -5.5]
+    lpos[f1:, :2] = lxy[f1:]
+    return Trial(subject_id, trial_id, lpos, fpos, np.zeros((n, 3)), tstamps, v0, 'pole', 3.5, np.full(n, -1))
+
+def make_experiment():
+    rng = np.random.RandomState(0)
+    exp = Experiment()
+    for i in [1, 2]:
+        exp.subjects[i] = Subject(i, leader='pole')
+        for j in range(24):
+            # lateral deviations below, between and above the 0.2 and 0.3 m thresholds
+            lateral = [0.0, 0.25, 0.5, 0.1][(j // 6 + i) % 4]
+            exp.subjects[i].trials[j + 1] = make_trial(i, j + 1, V0S[j % 6], lateral, rng)
+    return exp
+
+def test_overtake_rates_equal_helper():
+    exp = make_experiment()
+    summary = Tomato3_summary.summarize(exp)
+    for i, subject in exp.subjects.items():
+        expected = Tomato3_helper.overtake_rates(subject)
+        assert Tomato3_summary.overtake_rates(summary, i) == expected
+        expected = Tomato3_helper.overtake_rates(subject, 0.3)
+        assert Tomato3_summary.overtake_rates(summary, i, 0.3) == expected
+
+def test_summary_after_incremental_update(tmp_path, monkeypatch):
+    output_dir, input_dir, store = make_dirs(str(tmp_path))
+    write_trial(output_dir, 1, 1, seed=1)
+    write_trial(output_dir, 2, 1, seed=2)
+    update_store(output_dir, input_dir, store, processes=1)
+    # appended at the end of the trial table, before (2, 1) in get_trials
+    write_trial(output_dir, 1, 2, seed=3)
+    update_store(output_dir, input_dir, store, processes=1)
+    trials = read_tables(store)[0].set_index(['subject_id', 'trial_id'])
+    summary = Tomato3_summary.trial_summary(store)
+    assert list(zip(summary['subject_id'], summary['trial_id'])) == [(1, 1), (1, 2), (2, 1)]
+    for _, row in summary.iterrows():
+        key = (row['subject_id'], row['trial_id'])
+        assert (row['segment'], row['offset']) == (trials.loc[key, 'segment'], trials.loc[key, 'offset'])
+    # the saved summary is current, so it is not computed again
+    def fail(*args, **kwargs):
+        raise AssertionError('summary recomputed')
+    monkeypatch.setattr(Tomato3_summary, 'summarize', fail)
+    again = Tomato3_summary.trial_summary(store)
+    assert (again[Tomato3_summary.KEYS].values == summary[Tomato3_summary.KEYS].values).all()
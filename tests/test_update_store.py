@@ -0,0 +1,73 @@
+import os
+import sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+from Tomato3_importData import update_store, load_csv
+from Tomato3_store import load_experiment
+
+def write_trial(output_dir, subject_id, trial_id, v0=1.2, seed=0):
+    rng = np.random.RandomState(seed)
+    n = 300
+    t = np.arange(n) / 90.0
+    lpos = np.zeros((n, 3))
+    lpos[100:, 2] = 2 + v0 * t[:n - 100]
+    fpos = np.column_stack((rng.normal(0, 0.01, n), np.zeros(n), 1.2 * t))
+    data = np.column_stack((lpos, fpos, np.zeros((n, 3)), t, np.full(n, -1)))
+    name = 'Tomato3_subj' + str(subject_id).zfill(2) + '_trial' + str(trial_id).zfill(3) + '_2, ' + str(v0) + ', pole.csv'
+    np.savetxt(os.path.join(output_dir, name), data, delimiter=',', fmt='%.4f')
+    return name
+
+def make_dirs(tmpdir):
+    output_dir, input_dir = os.path.join(tmpdir, 'output'), os.path.join(tmpdir, 'input')
+    os.makedirs(output_dir)
+    os.makedirs(input_dir)
+    return output_dir, input_dir, os.path.join(tmpdir, 'store')
+
+def check(store, fpos):
+    exp = load_experiment(store)
+    trials = exp.get_trials()
+    assert len(trials) == len(fpos)
+    for t in trials:
+        assert np.allclose(t.fpos[:, 0], fpos[(t.subject_id, t.trial_id)], atol=1e-4)
+    assert len(os.listdir(os.path.join(store, 'segments'))) == 1
+
+def test_change_every_file(tmp_path):
+    output_dir, input_dir, store = make_dirs(str(tmp_path))
+    for i in range(1, 4):
+        write_trial(output_dir, 1, i, seed=i)
+    update_store(output_dir, input_dir, store, processes=1)
+    # every trial of segment 000 is dropped, the new segment must not reuse its id
+    fpos = {}
+    for i in range(1, 4):
+        name = write_trial(output_dir, 1, i, seed=10 + i)
+        fpos[(1, i)] = np.loadtxt(os.path.join(output_dir, name), delimiter=',')[:, 3]
+    report = update_store(output_dir, input_dir, store, processes=1)
+    assert len(report['changed']) == 3
+    check(store, fpos)
+
+def test_change_new_file(tmp_path):
+    output_dir, input_dir, store = make_dirs(str(tmp_path))
+    write_trial(output_dir, 1, 1, seed=1)
+    update_store(output_dir, input_dir, store, processes=1)
+    name = write_trial(output_dir, 1, 2, seed=2)
+    update_store(output_dir, input_dir, store, processes=1)
+    # the trial of segment 001 is dropped while segment 000 is kept
+    write_trial(output_dir, 1, 2, seed=3)
+    report = update_store(output_dir, input_dir, store, processes=1)
+    assert report['changed'] == [name]
+    exp = load_experiment(store)
+    fpos = np.loadtxt(os.path.join(output_dir, name), delimiter=',')[:, 3]
+    assert np.allclose(exp.subjects[1].trials[2].fpos[:, 0], fpos, atol=1e-4)
+    assert len(exp.get_trials()) == 2
+
+def test_truncated_last_row(tmp_path):
+    output_dir, input_dir, store = make_dirs(str(tmp_path))
+    name = write_trial(output_dir, 1, 1)
+    path = os.path.join(output_dir, name)
+    with open(path, 'r') as f:
+        text = f.read()
+    with open(path, 'w') as f:
+        f.write(text[:text.rstrip().rindex(',')])
+    with pytest.raises(Exception, match='300 rows'):
+        load_csv(path, 11)